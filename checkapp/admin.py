@@ -1,9 +1,132 @@
 from django.contrib import admin
-from .models import CartItem
+from django.utils.html import format_html, format_html_join
 
-# Register your models here.
+from .models import BillingDetails, CartItem, Order, OrderItem, Product, StockShard, UserOrderStats
+from .receipts import Receipt
+from .search import search_products
+from .services import change_order_status
 
+# Changelists are built to stay cheap on large tables: related rows used by
+# __str__ / list_display are joined in (list_select_related), foreign keys are
+# edited by id (raw_id_fields) instead of rendering a <select> of every row,
+# search uses exact or indexed lookups, and show_full_result_count = False
+# skips the unfiltered COUNT(*) on every filtered page.
 
-from .models import Product
-admin.site.register(Product)
-admin.site.register(CartItem)
\ No newline at end of file
+
+class StockShardInline(admin.TabularInline):
+    # A product with no shards is not stock-tracked; the set_stock command spreads a total evenly
+    model = StockShard
+    extra = 0
+    ordering = ['shard']
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ['name', 'sku', 'price', 'updated_at']
+    # Exact sku here; names and descriptions go through the full-text index below
+    search_fields = ['=sku']
+    search_limit = 200  # best full-text matches listed
+    ordering = ['-id']
+    show_full_result_count = False
+    inlines = [StockShardInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        by_sku, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term:
+            return by_sku, may_have_duplicates
+        matches = search_products(search_term, Product.objects.only('id'), page_size=self.search_limit)
+        return by_sku | queryset.filter(id__in=[product.id for product in matches.items]), may_have_duplicates
+
+
+@admin.register(CartItem)
+class CartItemAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'cartproduct', 'quantity']
+    list_select_related = ['user', 'cartproduct']
+    raw_id_fields = ['user', 'cartproduct']
+    search_fields = ['=user__username']
+    ordering = ['-id']
+    show_full_result_count = False
+
+
+@admin.register(BillingDetails)
+class BillingDetailsAdmin(admin.ModelAdmin):
+    list_display = ['Full_name', 'phone_number', 'user']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    search_fields = ['=phone_number', '=user__username']
+    ordering = ['-id']
+    show_full_result_count = False
+
+
+def _status_action(status):
+    def action(modeladmin, request, queryset):
+        # One UPDATE for the whole selection (plus the matching UserOrderStats changes)
+        changed = change_order_status(queryset, status)
+        modeladmin.message_user(request, f"Marked {changed} order(s) as {status}.")
+
+    action.__name__ = f"mark_{status.lower().replace(' ', '_')}"
+    return admin.action(description=f'Mark selected orders as "{status}"')(action)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order_date', 'customer', 'user', 'status', 'total_price', 'total_quantity']
+    list_select_related = ['receipt', 'user']
+    # Both filters are answered by order_status_date_idx / order_date_idx
+    list_filter = ['status', 'order_date']
+    search_fields = ['=id', '=razorpay_order_id', '=user__username']
+    ordering = ['-order_date', '-id']
+    list_per_page = 50
+    show_full_result_count = False
+    raw_id_fields = ['user', 'billing_details']
+    # Status only changes through the actions, so UserOrderStats stays in step
+    readonly_fields = ['status', 'order_date', 'razorpay_order_id', 'razorpay_amount', 'razorpay_currency', 'receipt_summary']
+    actions = [_status_action(status) for status in UserOrderStats.STATUS_COUNTERS]
+
+    def get_queryset(self, request):
+        # Customer, lines and address come from the receipt snapshot joined into the order row.
+        # Applied here rather than by list_select_related alone so the change view gets it too.
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+    @admin.display(description='Customer')
+    def customer(self, order):
+        return order.receipt.data['billing']['name']
+
+    @admin.display(description='Receipt')
+    def receipt_summary(self, order):
+        receipt = Receipt(order.receipt.data)
+        delivery = receipt.delivery
+        return format_html(
+            '<p>{} ({})<br>{}</p><table><tr><th>Item</th><th>Qty</th><th>Price</th><th>Line total</th></tr>{}</table>',
+            delivery.Full_name, delivery.phone_number, delivery.Address,
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+                (line.name, line.quantity, line.price, line.total_cost) for line in receipt.lines
+            )),
+        )
+
+    def has_add_permission(self, request):
+        return False  # orders are created by checkout
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order_id', 'product', 'quantity', 'price']
+    list_select_related = ['product']
+    raw_id_fields = ['order', 'product']
+    search_fields = ['=order__id']
+    ordering = ['-id']
+    show_full_result_count = False
+
+
+@admin.register(UserOrderStats)
+class UserOrderStatsAdmin(admin.ModelAdmin):
+    # Maintained by checkapp/stats.py; fix drift with the rebuild_order_stats command
+    list_display = ['user', 'order_count', 'lifetime_spend', 'last_order_date', 'pending_count', 'paid_count', 'failed_count']
+    list_select_related = ['user']
+    search_fields = ['=user__username']
+    ordering = ['-user_id']  # the primary key; last_order_date has no index
+    show_full_result_count = False
+    readonly_fields = [field.name for field in UserOrderStats._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CheckappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'checkapp'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
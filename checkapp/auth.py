@@ -0,0 +1,50 @@
+"""
+Authenticated-user lookups served from the cache.
+
+AuthenticationMiddleware loads request.user through the backend's get_user()
+on every request that reads it. With CachedModelBackend that is a cache hit
+for AUTH_USER_CACHE_TIMEOUT seconds after the first lookup instead of a
+SELECT on auth_user. signals.py drops the cached copy whenever the user is
+saved or deleted; that includes last_login updates and password changes, so
+the session hash check sees a new password at once. Writes that bypass
+save(), such as QuerySet.update(), show up when the entry expires.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+DEFAULT_TIMEOUT = 300  # seconds
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user() goes to the database once per timeout."""
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)  # None for unknown and inactive users, which aren't cached
+            if user is not None and _timeout():
+                cache.set(key, user, _timeout())
+        return user
+
+    async def aget_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None and _timeout():
+                await cache.aset(key, user, _timeout())
+        return user
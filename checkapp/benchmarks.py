@@ -0,0 +1,380 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a throwaway copy of the configured database (created
+with Django's test-database machinery), so the numbers reflect the active
+DB_ENGINE / SQLITE_TUNING profile without touching real data.
+"""
+import math
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .gateway import get_gateway
+from .models import BillingDetails, CartItem, Order, Product
+from .services import ensure_gateway_order, place_order
+from .stock import set_stock, stock_levels
+
+
+def git_revision():
+    """Short hash of the checked-out commit, recorded with every benchmark result."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def database_profile():
+    settings_dict = connection.settings_dict
+    options = settings_dict.get('OPTIONS', {})
+    return {
+        'vendor': connection.vendor,
+        'conn_max_age': settings_dict.get('CONN_MAX_AGE'),
+        'pool': bool(options.get('pool')),
+        'init_command': options.get('init_command', ''),
+        'transaction_mode': options.get('transaction_mode'),
+    }
+
+
+@contextmanager
+def scratch_database():
+    """Create an empty, migrated copy of the default database and drop it afterwards."""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        close_old_connections()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed_products(count, price='499.00'):
+    return Product.objects.bulk_create([
+        Product(name=f'Bench product {i}', price=Decimal(price), description='x' * 400, image='products/bench.jpeg')
+        for i in range(count)
+    ])
+
+
+def seed_users(count, prefix='bench'):
+    # Passwords are unusable on purpose: hashing would dominate the seeding time
+    users = [User(username=f'{prefix}{i}@example.com') for i in range(count)]
+    for user in users:
+        user.set_unusable_password()
+    return User.objects.bulk_create(users)
+
+
+def fill_carts(users, products, cart_size, quantity=1):
+    CartItem.objects.bulk_create([
+        CartItem(user=user, cartproduct=products[i % len(products)], quantity=quantity)
+        for user in users
+        for i in range(cart_size)
+    ])
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (milliseconds) for one benchmark step."""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'p50_ms': _ms(percentile(ordered, 0.50)),
+        'p95_ms': _ms(percentile(ordered, 0.95)),
+        'p99_ms': _ms(percentile(ordered, 0.99)),
+        'max_ms': _ms(ordered[-1] if ordered else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run_concurrently(jobs, threads):
+    """
+    Run the callables in `jobs` on `threads` worker threads, each job timed.
+    Returns (latencies in seconds, error count, wall-clock seconds).
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    pending = iter(jobs)
+    start = threading.Barrier(threads)
+
+    def worker():
+        start.wait()
+        try:
+            while True:
+                with lock:
+                    job = next(pending, None)
+                if job is None:
+                    return
+                began = time.perf_counter()
+                try:
+                    job()
+                except Exception as exc:
+                    with lock:
+                        errors.append(exc)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - began)
+        finally:
+            close_old_connections()
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    began = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors, time.perf_counter() - began
+
+
+# --- Checkout funnel ---
+
+FUNNEL_STEPS = (
+    'product_list', 'add_to_cart', 'cart_view', 'checkout', 'place_order', 'order_confirmation', 'payment_success',
+)
+
+BENCH_BILLING = {'phone_number': '9999999999', 'Full_name': 'Bench User', 'Address': 'Bench street'}
+
+
+class FunnelRecorder:
+    """Latency and query count of every request, grouped by funnel step."""
+
+    def __init__(self):
+        self.latencies = {step: [] for step in FUNNEL_STEPS}
+        self.queries = {step: [] for step in FUNNEL_STEPS}
+        self.errors = dict.fromkeys(FUNNEL_STEPS, 0)
+        self._lock = threading.Lock()
+
+    def request(self, step, send, path, data=None, expect=200):
+        began = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = send(path, data) if data is not None else send(path)
+        elapsed = time.perf_counter() - began
+        with self._lock:
+            if response.status_code != expect:
+                self.errors[step] += 1
+                raise AssertionError(f"{step}: HTTP {response.status_code} from {path}")
+            self.latencies[step].append(elapsed)
+            self.queries[step].append(len(queries))
+        return response
+
+    def results(self, elapsed):
+        results = {}
+        for step in FUNNEL_STEPS:
+            counts = self.queries[step]
+            results[step] = {
+                **summarize(self.latencies[step], elapsed, self.errors[step]),
+                'queries_mean': round(sum(counts) / len(counts), 2) if counts else None,
+                'queries_max': max(counts, default=None),
+            }
+        return results
+
+
+def checkout_funnel(user, products, recorder):
+    """
+    One shopper's whole visit, as a job for run_concurrently: browse, add
+    every product to the cart, review it, check out, open the confirmation
+    page and come back from the gateway with a valid signature.
+    """
+    def job():
+        client = Client()
+        client.force_login(user)
+        recorder.request('product_list', client.get, reverse('product_list'))
+        for product in products:
+            recorder.request('add_to_cart', client.get, reverse('add_to_cart', args=[product.id]), expect=302)
+        recorder.request('cart_view', client.get, reverse('cart_view'))
+        recorder.request('checkout', client.get, reverse('checkout'))
+        placed = recorder.request('place_order', client.post, reverse('checkout'), BENCH_BILLING, expect=302)
+        recorder.request('order_confirmation', client.get, placed['Location'])
+
+        # Not timed: look up this shopper's order as the payment page would know it
+        order = ensure_gateway_order(Order.objects.filter(user=user).latest('id'))
+        payment_id = f'pay_bench{order.pk}'
+        recorder.request('payment_success', client.post, reverse('payment_success') + f'?order_id={order.pk}', {
+            'razorpay_order_id': order.razorpay_order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': get_gateway().sign(order.razorpay_order_id, payment_id),
+        })
+    return job
+
+
+def run_funnel(users, products, cart_size, threads):
+    """Drive one funnel per user; returns per-step results and the whole-funnel summary."""
+    recorder = FunnelRecorder()
+    jobs = [
+        checkout_funnel(user, [products[(n + i) % len(products)] for i in range(cart_size)], recorder)
+        for n, user in enumerate(users)
+    ]
+    latencies, errors, elapsed = run_concurrently(jobs, threads)
+    return {
+        'funnel': summarize(latencies, elapsed, len(errors)),
+        'steps': recorder.results(elapsed),
+        'error_samples': sorted({repr(exc) for exc in errors})[:5],
+    }
+
+
+# --- Flash sale (stock contention) ---
+
+def flash_sale_buyer(user, product, outcomes, lock):
+    """
+    One buyer of the hot product, as a job for run_concurrently: the
+    add-to-cart runs first, then the checkout POST, through the real views.
+    """
+    client = Client()
+    client.force_login(user)
+
+    def job():
+        client.get(reverse('add_to_cart', args=[product.id]))
+        response = client.post(reverse('checkout'), BENCH_BILLING)
+        if response.status_code == 302:
+            outcome = 'sold'
+        elif response.status_code == 200 and b'sold out' in response.content:
+            outcome = 'sold_out'
+        else:
+            raise AssertionError(f"checkout: HTTP {response.status_code}")
+        with lock:
+            outcomes[outcome] += 1
+    return job
+
+
+def run_flash_sale(users, product, threads, stock=None, shards=None):
+    """
+    Every user buys one unit of `product` at the same time. With `stock` set,
+    that many units go on sale over `shards` counters; without it the product
+    is untracked, i.e. the checkout flow as it was before reservations.
+    """
+    if stock is not None:
+        set_stock(product, stock, shards)
+    outcomes, lock = {'sold': 0, 'sold_out': 0}, threading.Lock()
+    jobs = [flash_sale_buyer(user, product, outcomes, lock) for user in users]
+    latencies, errors, elapsed = run_concurrently(jobs, threads)
+    remaining = stock_levels([product.id]).get(product.id)
+    return {
+        'stock': stock,
+        'shards': shards if stock is not None else None,
+        **outcomes,
+        'remaining': remaining,
+        'oversold': stock is not None and (outcomes['sold'] > stock or remaining < 0),
+        'checkout': summarize(latencies, elapsed, len(errors)),
+        'error_samples': sorted({repr(exc) for exc in errors})[:5],
+    }
+
+
+# --- Session and user lookup overhead ---
+
+SESSION_PROFILES = {
+    # Django's defaults: django_session and auth_user are read on every request
+    'db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    # One process, so a process-local cache is shared by every simulated request
+    'cached_db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'AUTHENTICATION_BACKENDS': ['checkapp.auth.CachedModelBackend'],
+        'AUTH_USER_CACHE_TIMEOUT': 300,
+    },
+    'cache': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cache',
+        'AUTHENTICATION_BACKENDS': ['checkapp.auth.CachedModelBackend'],
+        'AUTH_USER_CACHE_TIMEOUT': 300,
+    },
+}
+
+SESSION_PAGES = ('cart_view', 'order_history')
+
+AUTH_TABLES = ('"django_session"', '"auth_user"')
+
+
+def seed_shoppers(count, products, orders_per_user=2):
+    """Users with a few past orders, so the history page has rows to show."""
+    users = seed_users(count, prefix='session')
+    for _ in range(orders_per_user):
+        fill_carts(users, products, cart_size=len(products))
+        for user in users:
+            place_order(user, BillingDetails(**BENCH_BILLING))
+    return users
+
+
+def measure_pages(users, products, repeats):
+    """Per page: latency percentiles, mean queries and mean session/user queries per request."""
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        for product in products:
+            client.get(reverse('add_to_cart', args=[product.id]))
+        for page in SESSION_PAGES:
+            client.get(reverse(page))  # warm the session and user caches
+        clients.append(client)
+
+    results = {}
+    for page in SESSION_PAGES:
+        url, latencies, queries, auth_queries = reverse(page), [], [], []
+        began = time.perf_counter()
+        for _ in range(repeats):
+            for client in clients:
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get(url)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise AssertionError(f"{page}: HTTP {response.status_code}")
+                queries.append(len(captured))
+                auth_queries.append(sum(
+                    any(table in query['sql'] for table in AUTH_TABLES) for query in captured.captured_queries
+                ))
+        results[page] = {
+            **summarize(latencies, time.perf_counter() - began),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'session_user_queries_mean': round(sum(auth_queries) / len(auth_queries), 2),
+        }
+    return results
+
+
+def run_session_overhead(users, products, repeats, profiles=('db', 'cached_db')):
+    """
+    cart_view and order_history under each session/user-lookup profile, plus
+    what every later profile saves per request compared with the first one.
+    """
+    runs = {}
+    for name in profiles:
+        with override_settings(**SESSION_PROFILES[name]):
+            cache.clear()
+            runs[name] = measure_pages(users, products, repeats)
+
+    baseline = runs[profiles[0]]
+    saved = {
+        name: {
+            page: {
+                'queries': round(baseline[page]['queries_mean'] - runs[name][page]['queries_mean'], 2),
+                'p50_ms': round(baseline[page]['p50_ms'] - runs[name][page]['p50_ms'], 3),
+            }
+            for page in SESSION_PAGES
+        }
+        for name in profiles[1:]
+    }
+    return {'profiles': runs, 'saved_per_request': saved}
+
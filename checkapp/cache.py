@@ -0,0 +1,43 @@
+"""
+Versioned cache keys for product data.
+
+Every cached catalogue page or product page has the current catalogue version
+in its key. Saving or deleting a Product bumps the version (see signals.py),
+so all old entries stop being read at once and simply expire.
+"""
+from django.core.cache import cache
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_CACHE_TIMEOUT = 60 * 15
+
+
+def catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY, 1)
+    return version
+
+
+async def acatalogue_version():
+    version = await cache.aget(CATALOGUE_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOGUE_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(CATALOGUE_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        # Key missing (evicted or never set): any fresh value invalidates old keys
+        cache.set(CATALOGUE_VERSION_KEY, catalogue_version() + 1, timeout=None)
+
+
+def catalogue_key(*parts):
+    return ':'.join(['catalogue', f'v{catalogue_version()}', *map(str, parts)])
+
+
+async def acatalogue_key(*parts):
+    return ':'.join(['catalogue', f'v{await acatalogue_version()}', *map(str, parts)])
@@ -0,0 +1,215 @@
+"""
+Cart storage.
+
+Views talk to a cart object from get_cart(request) and never to CartItem
+directly. Two interchangeable backends exist:
+
+- SessionCart keeps {product id: quantity} in the session. Anonymous carts
+  always live here, and with CART_BACKEND = 'session' (the default) so do
+  logged-in users' active carts, so browsing and adding never touch CartItem.
+- DatabaseCart reads and writes CartItem rows directly.
+
+CartItem stays the durable copy of a logged-in user's cart: the session cart
+is merged with it on login and bulk-flushed into it at checkout and logout.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import CartItem, Product
+
+SESSION_KEY = 'cart'
+# Which user's saved cart the session cart already includes
+MERGED_FOR_KEY = 'cart_merged_for'
+
+
+@dataclass
+class CartLine:
+    # Same attribute names as CartItem so templates work with either backend
+    cartproduct: Product
+    quantity: int
+
+    @property
+    def total_cost(self):
+        return self.quantity * self.cartproduct.price
+
+
+class SessionCart:
+    def __init__(self, session):
+        self.session = session
+        self._lines = None
+
+    @property
+    def _items(self):
+        return self.session.get(SESSION_KEY, {})
+
+    def _save(self, items):
+        self.session[SESSION_KEY] = items
+        self._lines = None
+
+    def quantities(self):
+        return {int(product_id): quantity for product_id, quantity in self._items.items()}
+
+    def add(self, product_id, quantity=1):
+        items = dict(self._items)
+        items[str(product_id)] = items.get(str(product_id), 0) + quantity
+        self._save(items)
+
+    def set(self, product_id, quantity):
+        """Change the quantity of a line already in the cart; 0 or less removes it."""
+        items = dict(self._items)
+        if str(product_id) not in items:
+            return
+        if quantity > 0:
+            items[str(product_id)] = quantity
+        else:
+            items.pop(str(product_id), None)
+        self._save(items)
+
+    def remove(self, product_id):
+        self.set(product_id, 0)
+
+    def replace(self, quantities):
+        self._save({str(product_id): quantity for product_id, quantity in quantities.items() if quantity > 0})
+
+    def clear(self):
+        self.session.pop(SESSION_KEY, None)
+        self._lines = None
+
+    def lines(self):
+        if self._lines is None:
+            quantities = self.quantities()
+            products = Product.objects.in_bulk(quantities)
+            self._lines = [
+                CartLine(products[product_id], quantity)
+                for product_id, quantity in quantities.items()
+                if product_id in products
+            ]
+        return self._lines
+
+    def totals(self):
+        # Lines are already loaded with their products, so no extra query
+        lines = self.lines()
+        return {
+            'total_amount': sum((line.total_cost for line in lines), Decimal('0.00')),
+            'item_count': sum(line.quantity for line in lines),
+        }
+
+
+class DatabaseCart:
+    def __init__(self, user):
+        self.user = user
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(user=self.user).values_list('cartproduct_id', 'quantity'))
+
+    def add(self, product_id, quantity=1):
+        # Single-statement increment; the unique (user, cartproduct) constraint turns
+        # a concurrent first insert into an IntegrityError instead of a duplicate row
+        line = CartItem.objects.filter(user=self.user, cartproduct_id=product_id)
+        if line.update(quantity=F('quantity') + quantity):
+            return
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(user=self.user, cartproduct_id=product_id, quantity=quantity)
+        except IntegrityError:
+            line.update(quantity=F('quantity') + quantity)
+
+    def set(self, product_id, quantity):
+        items = CartItem.objects.filter(user=self.user, cartproduct_id=product_id)
+        if quantity > 0:
+            items.update(quantity=quantity)
+        else:
+            items.delete()
+
+    def remove(self, product_id):
+        self.set(product_id, 0)
+
+    def clear(self):
+        CartItem.objects.filter(user=self.user).delete()
+
+    def lines(self):
+        return list(CartItem.objects.filter(user=self.user).with_products().order_by('id'))
+
+    def totals(self):
+        return CartItem.objects.filter(user=self.user).totals()
+
+
+def uses_database(user):
+    return user.is_authenticated and getattr(settings, 'CART_BACKEND', 'session') == 'database'
+
+
+def get_cart(request):
+    if uses_database(request.user):
+        return DatabaseCart(request.user)
+    return SessionCart(request.session)
+
+
+def save_cart(user, quantities):
+    """
+    Make the user's CartItem rows match `quantities` ({product id: quantity})
+    with one read plus at most one bulk insert, update and delete.
+    """
+    existing = {item.cartproduct_id: item for item in CartItem.objects.filter(user=user)}
+
+    to_create, to_update = [], []
+    for product_id, quantity in quantities.items():
+        item = existing.get(product_id)
+        if item is None:
+            to_create.append(CartItem(user=user, cartproduct_id=product_id, quantity=quantity))
+        elif item.quantity != quantity:
+            item.quantity = quantity
+            to_update.append(item)
+    stale = [item.id for product_id, item in existing.items() if product_id not in quantities]
+
+    if to_create:
+        # Session carts can still hold products deleted since they were added
+        live = set(Product.objects.filter(id__in=[item.cartproduct_id for item in to_create]).values_list('id', flat=True))
+        to_create = [item for item in to_create if item.cartproduct_id in live]
+        CartItem.objects.bulk_create(
+            to_create,
+            update_conflicts=True,
+            unique_fields=['user', 'cartproduct'],
+            update_fields=['quantity'],
+        )
+    if to_update:
+        CartItem.objects.bulk_update(to_update, ['quantity'])
+    if stale:
+        CartItem.objects.filter(id__in=stale).delete()
+
+
+def merge_cart_on_login(request, user):
+    """
+    Runs right after every login() (signals.py connects it to user_logged_in):
+    folds the anonymous session cart together with the cart the user saved
+    earlier, adding quantities for shared products.
+    """
+    # Logging in again in the same session (e.g. a staff user signing in to the admin)
+    # keeps the session, whose cart already holds the saved quantities
+    if request.session.get(MERGED_FOR_KEY) == user.pk:
+        return
+    request.session[MERGED_FOR_KEY] = user.pk
+
+    session_cart = SessionCart(request.session)
+    anonymous = session_cart.quantities()
+    if uses_database(user) and not anonymous:
+        return
+
+    merged = DatabaseCart(user).quantities()
+    for product_id, quantity in anonymous.items():
+        merged[product_id] = merged.get(product_id, 0) + quantity
+
+    if uses_database(user):
+        save_cart(user, merged)
+        session_cart.clear()
+    else:
+        session_cart.replace(merged)
+
+
+def flush_cart(request):
+    """Write a logged-in user's session cart to CartItem (before checkout and logout)."""
+    if request.user.is_authenticated and not uses_database(request.user):
+        save_cart(request.user, SessionCart(request.session).quantities())
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+CACHED_SESSION_ENGINES = {'django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.cached_db'}
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Cached sessions and users need a cache every worker sees, or logouts don't reach them all."""
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    cached = []
+    if settings.SESSION_ENGINE in CACHED_SESSION_ENGINES:
+        cached.append(f"SESSION_ENGINE = {settings.SESSION_ENGINE!r}")
+    if getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 0):
+        cached.append(f"AUTH_USER_CACHE_TIMEOUT = {settings.AUTH_USER_CACHE_TIMEOUT}")
+    if not cached:
+        return []
+    return [Error(
+        f"{' and '.join(cached)} with the per-process LocMemCache.",
+        hint=(
+            "Logouts, password changes and deactivations would only reach the worker that handled them. "
+            "Configure a shared cache (CACHE_BACKEND / CACHE_LOCATION), or use the 'db' session engine "
+            "and AUTH_USER_CACHE_TIMEOUT = 0."
+        ),
+        id='checkapp.E001',
+    )]
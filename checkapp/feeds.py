@@ -0,0 +1,238 @@
+"""
+Product feeds: streaming CSV / JSON Lines import and export.
+
+Both directions work row by row, so memory stays bounded by the batch size
+whatever the feed length. Imports match products on their natural key (sku)
+and write each batch with one lookup, one bulk_create and one bulk_update.
+Exports walk the table with iterator(chunk_size=...) and yield encoded lines,
+ready for a file or a StreamingHttpResponse.
+"""
+import csv
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils._os import safe_join
+
+from .cache import bump_catalogue_version
+from .models import Product
+from .search import index_products
+from .storage import product_image_storage
+
+FEED_FIELDS = ['sku', 'name', 'price', 'description', 'image']
+UPDATE_FIELDS = ['name', 'price', 'description', 'image']
+FORMATS = ('csv', 'jsonl')
+
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+IMAGE_UPLOAD_DIR = Product._meta.get_field('image').upload_to
+
+
+class FeedError(ValueError):
+    """A feed row that cannot be turned into a product."""
+
+
+def guess_format(path, default='csv'):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return {'ndjson': 'jsonl', 'json': 'jsonl'}.get(extension, extension) if extension else default
+
+
+def read_rows(stream, fmt):
+    """
+    Yield one row per record of a text stream: a dict for CSV, the undecoded
+    line for JSON Lines (ProductImporter decodes it, so one bad line is one
+    rejected row rather than a failed import).
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield line
+    else:
+        raise FeedError(f"Unknown feed format {fmt!r}")
+
+
+def _is_file_name(name):
+    return bool(name) and name not in ('.', '..') and '/' not in name and '\\' not in name
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    errors: list = field(default_factory=list)  # the first MAX_ERRORS_KEPT messages
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows in {self.elapsed:.1f}s ({self.rows_per_second:,.0f} rows/s): "
+            f"{self.created} created, {self.updated} updated, {self.unchanged} unchanged, "
+            f"{self.rejected} rejected"
+        )
+
+
+class ProductImporter:
+    """
+    Upsert products from feed rows, `batch_size` rows per transaction.
+
+    An `image` column is a file name inside `image_dir` when one is given
+    (the file is stored under its content hash, so a picture shared by many
+    rows is stored once) and an existing storage name otherwise. Rows whose
+    image points outside the directory, or is a path rather than a stored
+    name, are rejected.
+    """
+
+    MAX_ERRORS_KEPT = 100
+
+    def __init__(self, batch_size=1000, image_dir=None):
+        self.batch_size = batch_size
+        self.image_dir = image_dir
+        # Feeds often repeat a picture across variants: store each file once per run
+        self._store_image = lru_cache(maxsize=4096)(self._store_image_file)
+
+    def run(self, rows, progress=None):
+        report = ImportReport()
+        batch = {}
+        for line, row in enumerate(rows, start=1):
+            report.rows += 1
+            try:
+                values = self.clean(self.decode(row))
+            except (FeedError, KeyError, TypeError, OSError) as exc:
+                self._reject(report, line, exc)
+                continue
+            batch[values['sku']] = values  # a later row for the same sku wins
+            if len(batch) >= self.batch_size:
+                self.write(batch, report)
+                batch = {}
+                if progress:
+                    progress(report)
+        if batch:
+            self.write(batch, report)
+        if report.created or report.updated:
+            bump_catalogue_version()  # bulk writes send no save signals
+        return report
+
+    def _reject(self, report, line, exc):
+        report.rejected += 1
+        if len(report.errors) < self.MAX_ERRORS_KEPT:
+            report.errors.append(f"row {line}: {exc}")
+
+    def decode(self, row):
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except ValueError as exc:
+                raise FeedError(f"invalid JSON: {exc}") from None
+        if not isinstance(row, dict):
+            raise FeedError(f"expected a JSON object, got {type(row).__name__}")
+        return row
+
+    def clean(self, row):
+        sku = str(row.get('sku') or '').strip()
+        name = str(row.get('name') or '').strip()
+        if not sku or not name:
+            raise FeedError("sku and name are required")
+        if len(sku) > 64 or len(name) > 100:
+            raise FeedError("sku or name is too long")
+        try:
+            price = Decimal(str(row.get('price'))).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise FeedError(f"invalid price {row.get('price')!r}") from None
+        if not price.is_finite() or price < 0 or price.adjusted() >= 8:
+            raise FeedError(f"price out of range {price}")
+        return {
+            'sku': sku,
+            'name': name,
+            'price': price,
+            'description': str(row.get('description') or ''),
+            'image': self.image_name(str(row.get('image') or '').strip()),
+        }
+
+    def image_name(self, value):
+        if not value:
+            return value
+        if not self.image_dir:
+            # Only a name already stored in the upload directory (as exported), never a path
+            name = value.removeprefix(IMAGE_UPLOAD_DIR)
+            if not _is_file_name(name):
+                raise FeedError(f"image {value!r} is not a stored image name")
+            return value
+        if '\\' in value:
+            raise FeedError(f"image {value!r} is outside the image directory")
+        try:
+            path = safe_join(self.image_dir, value)
+        except SuspiciousFileOperation:
+            raise FeedError(f"image {value!r} is outside the image directory") from None
+        return self._store_image(path)
+
+    def _store_image_file(self, path):
+        with open(path, 'rb') as handle:
+            return product_image_storage.save(IMAGE_UPLOAD_DIR + os.path.basename(path), File(handle))
+
+    @transaction.atomic
+    def write(self, batch, report):
+        existing = Product.objects.only('id', 'sku', *UPDATE_FIELDS).in_bulk(list(batch), field_name='sku')
+        now = timezone.now()
+        to_create, to_update = [], []
+        for sku, values in batch.items():
+            product = existing.get(sku)
+            if product is None:
+                to_create.append(Product(**values))
+                continue
+            # An empty image column keeps the current picture
+            values = {key: value for key, value in values.items() if value or key != 'image'}
+            if all(getattr(product, key) == value for key, value in values.items()):
+                report.unchanged += 1
+                continue
+            for key, value in values.items():
+                setattr(product, key, value)
+            product.updated_at = now  # bulk_update skips auto_now; product ETags depend on it
+            to_update.append(product)
+
+        Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+        Product.objects.bulk_update(to_update, [*UPDATE_FIELDS, 'updated_at'], batch_size=self.batch_size)
+        index_products(to_create + to_update)  # bulk writes skip the signal that does this
+        report.created += len(to_create)
+        report.updated += len(to_update)
+
+
+class _Echo:
+    """File-like object whose write() hands back the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(fmt, queryset=None, chunk_size=2000):
+    """Yield the encoded feed (header first for CSV), one line per product."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('id').values_list(*FEED_FIELDS).iterator(chunk_size=chunk_size)
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(FEED_FIELDS)
+        for row in rows:
+            yield writer.writerow(['' if value is None else value for value in row])
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(FEED_FIELDS, row)), default=str) + '\n'
+    else:
+        raise FeedError(f"Unknown feed format {fmt!r}")
@@ -0,0 +1,259 @@
+"""
+Payment gateway access for checkapp.
+
+Views never build a razorpay.Client themselves: they call get_gateway(), which
+returns one process-wide gateway built from settings.PAYMENT_GATEWAY. The
+Razorpay backend keeps a pooled keep-alive HTTP session, applies connect/read
+timeouts to every call and retries idempotent calls with jittered backoff.
+The a*-prefixed methods are for async views. When served by ASGI they go
+through an httpx.AsyncClient pooled on the server's event loop instead of
+blocking a thread; under WSGI (see has_long_lived_loop) they use the pooled
+sync session from a worker thread.
+FakeGateway answers in-process so load tests can run without reaching Razorpay.
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import random
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .metrics import timed
+
+
+DEFAULTS = {
+    'BACKEND': 'checkapp.gateway.RazorpayGateway',
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 2,
+    'RETRY_BACKOFF': 0.2,
+    'POOL_MAXSIZE': 20,
+    'WEBHOOK_SECRET': '',
+}
+
+
+# checkout/asgi.py turns this on: every request then runs on the server's one
+# long-lived event loop, so state kept per loop (asyncio locks, httpx pools)
+# is shared by all requests. Under WSGI, async_to_sync gives each async view
+# a throwaway loop, and per-loop state would be per-request.
+_long_lived_loop = False
+
+
+def use_long_lived_loop(enabled=True):
+    global _long_lived_loop
+    _long_lived_loop = enabled
+
+
+def has_long_lived_loop():
+    return _long_lived_loop
+
+
+class PaymentGatewayError(Exception):
+    """The gateway could not be reached or rejected the request."""
+
+
+class PaymentGateway:
+    """Base class: signature checks are local HMACs, network calls are backend specific."""
+
+    def __init__(self, key_id, key_secret, options):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.options = options
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        raise NotImplementedError
+
+    def fetch_order(self, gateway_order_id):
+        raise NotImplementedError
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        return await sync_to_async(self.create_order, thread_sensitive=False)(amount, currency, receipt)
+
+    async def afetch_order(self, gateway_order_id):
+        return await sync_to_async(self.fetch_order, thread_sensitive=False)(gateway_order_id)
+
+    def sign(self, gateway_order_id, payment_id):
+        msg = f"{gateway_order_id}|{payment_id}".encode()
+        return hmac.new(self.key_secret.encode(), msg, hashlib.sha256).hexdigest()
+
+    def verify_payment_signature(self, gateway_order_id, payment_id, signature):
+        return hmac.compare_digest(self.sign(gateway_order_id, payment_id), str(signature))
+
+    def sign_webhook(self, body):
+        secret = self.options['WEBHOOK_SECRET'].encode()
+        return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+    def verify_webhook_signature(self, body, signature):
+        if not self.options['WEBHOOK_SECRET']:
+            return False
+        return hmac.compare_digest(self.sign_webhook(body), str(signature))
+
+
+class RazorpayGateway(PaymentGateway):
+    def __init__(self, key_id, key_secret, options):
+        super().__init__(key_id, key_secret, options)
+        import razorpay
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # One keep-alive session per process: TLS handshakes are paid once per pooled connection
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=options['POOL_MAXSIZE'])
+        session.mount('https://', adapter)
+        self.client = razorpay.Client(session=session, auth=(key_id, key_secret))
+        self.timeout = (options['CONNECT_TIMEOUT'], options['READ_TIMEOUT'])
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        self._transient_errors = (
+            requests.ConnectionError,
+            requests.Timeout,
+            razorpay.errors.GatewayError,
+            razorpay.errors.ServerError,
+        )
+        self._errors = (requests.RequestException, razorpay.errors.BadRequestError) + self._transient_errors
+
+    def _call(self, func, *args, idempotent=False):
+        attempts = 1 + (self.options['MAX_RETRIES'] if idempotent else 0)
+        for attempt in range(attempts):
+            try:
+                with timed('gateway'):
+                    return func(*args, timeout=self.timeout)
+            except self._transient_errors as exc:
+                if attempt == attempts - 1:
+                    raise PaymentGatewayError(str(exc)) from exc
+                # Full jitter keeps retries from a burst of workers from arriving together
+                time.sleep(random.uniform(0, self.options['RETRY_BACKOFF'] * 2 ** attempt))
+            except self._errors as exc:
+                raise PaymentGatewayError(str(exc)) from exc
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        data = {"amount": amount, "currency": currency, "payment_capture": 1}
+        if receipt:
+            data["receipt"] = receipt
+        # Creating an order is not idempotent, so it is never retried
+        return self._call(self.client.order.create, data)
+
+    def fetch_order(self, gateway_order_id):
+        return self._call(self.client.order.fetch, gateway_order_id, idempotent=True)
+
+    def _async_client(self):
+        # httpx clients are tied to the event loop they were first used on; only
+        # used with a long-lived loop, where there is one client for the process
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.client.base_url,
+                auth=(self.key_id, self.key_secret),
+                timeout=httpx.Timeout(self.options['READ_TIMEOUT'], connect=self.options['CONNECT_TIMEOUT']),
+                limits=httpx.Limits(max_keepalive_connections=self.options['POOL_MAXSIZE']),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _acall(self, method, path, payload=None, idempotent=False):
+        import httpx
+
+        attempts = 1 + (self.options['MAX_RETRIES'] if idempotent else 0)
+        for attempt in range(attempts):
+            try:
+                with timed('gateway'):
+                    response = await self._async_client().request(method, path, json=payload)
+            except httpx.TransportError as exc:  # connect/read timeouts, refused or reset connections
+                error = exc
+            else:
+                if response.status_code < 400:
+                    return response.json()
+                try:
+                    error = response.json()['error']['description']
+                except (ValueError, KeyError, TypeError):
+                    error = f"HTTP {response.status_code}"
+                if response.status_code < 500:
+                    raise PaymentGatewayError(error)
+            if attempt == attempts - 1:
+                raise PaymentGatewayError(str(error))
+            await asyncio.sleep(random.uniform(0, self.options['RETRY_BACKOFF'] * 2 ** attempt))
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        if not has_long_lived_loop():
+            return await super().acreate_order(amount, currency, receipt)
+        data = {"amount": amount, "currency": currency, "payment_capture": 1}
+        if receipt:
+            data["receipt"] = receipt
+        return await self._acall('POST', '/v1/orders', data)
+
+    async def afetch_order(self, gateway_order_id):
+        if not has_long_lived_loop():
+            return await super().afetch_order(gateway_order_id)
+        return await self._acall('GET', f'/v1/orders/{gateway_order_id}', idempotent=True)
+
+
+class FakeGateway(PaymentGateway):
+    """In-process stand-in for Razorpay; orders live in memory."""
+
+    def __init__(self, key_id, key_secret, options):
+        super().__init__(key_id, key_secret, options)
+        self.orders = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        # Counted like a real call so load tests see how often the gateway is hit
+        with timed('gateway'), self._lock:
+            gateway_order_id = f"order_fake{next(self._ids):010d}"
+            order = {
+                "id": gateway_order_id,
+                "amount": amount,
+                "currency": currency,
+                "receipt": receipt,
+                "status": "created",
+            }
+            self.orders[gateway_order_id] = order
+        return dict(order)
+
+    def fetch_order(self, gateway_order_id):
+        try:
+            with timed('gateway'):
+                return dict(self.orders[gateway_order_id])
+        except KeyError:
+            raise PaymentGatewayError(f"Unknown order {gateway_order_id}") from None
+
+    # In-memory and non-blocking, so no thread hop is needed
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        return self.create_order(amount, currency, receipt)
+
+    async def afetch_order(self, gateway_order_id):
+        return self.fetch_order(gateway_order_id)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Return the process-wide payment gateway, building it on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                options = {**DEFAULTS, **getattr(settings, 'PAYMENT_GATEWAY', {})}
+                backend = import_string(options['BACKEND'])
+                _gateway = backend(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET, options)
+    return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(*, setting, **kwargs):
+    global _gateway
+    if setting in ('PAYMENT_GATEWAY', 'RAZORPAY_KEY_ID', 'RAZORPAY_KEY_SECRET'):
+        _gateway = None
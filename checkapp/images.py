@@ -0,0 +1,79 @@
+"""
+Resized / re-encoded variants of Product.image.
+
+Variants are written once to MEDIA_ROOT/derivatives/ (at upload time from the
+Product post_save signal, or lazily the first time a template asks for one)
+and served as plain media files afterwards. Originals are content-hash named
+(see storage.py), so a variant name never needs invalidating.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (160, 320, 640)
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+DERIVATIVE_QUALITY = 80
+
+derivative_storage = FileSystemStorage(allow_overwrite=True)
+
+# Variant names known to exist on disk; names are content-addressed, so this never goes stale
+_built = set()
+# Originals that could not be opened or decoded; logged once, then served as they are
+_unusable = set()
+
+
+def derivative_name(name, width, fmt):
+    stem = os.path.splitext(name)[0]
+    return f"derivatives/{stem}_{width}w.{fmt}"
+
+
+def _render(original, width, fmt):
+    from PIL import Image, ImageOps
+
+    with original.open('rb') as source, Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA') or (fmt == 'jpeg' and image.mode == 'RGBA'):
+            image = image.convert('RGB')
+        image.thumbnail((width, width * 4))  # keeps aspect ratio, never upscales
+        buffer = BytesIO()
+        image.save(buffer, DERIVATIVE_FORMATS[fmt], quality=DERIVATIVE_QUALITY, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def derivative_url(image, width, fmt='webp'):
+    """URL of `image` resized to `width` in `fmt`; the original's URL if it can't be produced."""
+    if not image:
+        return ''
+    name = derivative_name(image.name, width, fmt)
+    if name not in _built:
+        if image.name in _unusable:
+            return image.url
+        if not derivative_storage.exists(name):
+            try:
+                derivative_storage.save(name, _render(image, width, fmt))
+            except (OSError, ValueError) as exc:  # missing/corrupt original (PIL errors are OSErrors)
+                logger.warning("Serving original %s unresized: %s", image.name, exc)
+                _unusable.add(image.name)
+                return image.url
+        _built.add(name)
+    return derivative_storage.url(name)
+
+
+def generate_derivatives(image):
+    for fmt in DERIVATIVE_FORMATS:
+        for width in DERIVATIVE_WIDTHS:
+            derivative_url(image, width, fmt)
+
+
+@receiver(setting_changed)
+def reset_built(*, setting, **kwargs):
+    if setting == 'MEDIA_ROOT':
+        _built.clear()
+        _unusable.clear()
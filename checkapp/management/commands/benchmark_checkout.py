@@ -0,0 +1,68 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from checkapp.benchmarks import (
+    FUNNEL_STEPS, database_profile, git_revision, run_funnel, scratch_database, seed_products, seed_users,
+)
+from checkapp.cache import bump_catalogue_version
+
+
+def compare(baseline, result):
+    """p95 latency and mean query count per step, baseline -> current."""
+    comparison = {}
+    for step in FUNNEL_STEPS:
+        old, new = baseline.get('steps', {}).get(step), result['steps'][step]
+        if old:
+            comparison[step] = {key: [old.get(key), new[key]] for key in ('p95_ms', 'queries_mean')}
+    return comparison
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the checkout funnel (product list -> cart -> checkout -> confirmation -> "
+        "payment callback) against a scratch database with the fake gateway, and print "
+        "per-step throughput, latency percentiles and query counts as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help="Shoppers, one full funnel each.")
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--cart-size', type=int, default=3)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--output', help="Also write the JSON result to this file.")
+        parser.add_argument('--baseline', help="JSON result of an earlier run to compare against.")
+
+    def handle(self, *args, users, products, cart_size, threads, output, baseline, **options):
+        fake_gateway = {**settings.PAYMENT_GATEWAY, 'BACKEND': 'checkapp.gateway.FakeGateway'}
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        with scratch_database(), override_settings(PAYMENT_GATEWAY=fake_gateway, ALLOWED_HOSTS=hosts):
+            profile = database_profile()
+            catalogue = seed_products(max(products, cart_size))
+            shoppers = seed_users(users, prefix='funnel')
+            # Don't let catalogue pages cached from another database answer the run
+            bump_catalogue_version()
+            run = run_funnel(shoppers, catalogue, cart_size, threads)
+
+        result = {
+            'benchmark': 'checkout_funnel',
+            'revision': git_revision(),
+            'profile': profile,
+            'users': users,
+            'products': products,
+            'cart_size': cart_size,
+            'threads': threads,
+            **run,
+        }
+        if baseline:
+            with open(baseline) as handle:
+                result['comparison'] = compare(json.load(handle), result)
+
+        text = json.dumps(result, indent=2)
+        if output:
+            with open(output, 'w') as handle:
+                handle.write(text + '\n')
+        self.stdout.write(text)
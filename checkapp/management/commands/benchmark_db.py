@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from checkapp.benchmarks import (
+    database_profile, fill_carts, git_revision, run_concurrently, scratch_database, seed_products, seed_users,
+    summarize,
+)
+from checkapp.models import BillingDetails
+from checkapp.services import place_order
+
+
+COMPARED_KEYS = ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')
+
+
+def compare(baseline, result):
+    """Database profile and checkout throughput / latency / errors, baseline -> current."""
+    old, new = baseline.get('checkout', {}), result['checkout']
+    comparison = {
+        'profile': [baseline.get('profile'), result['profile']],
+        **{key: [old.get(key), new[key]] for key in COMPARED_KEYS},
+    }
+    if old.get('throughput_per_s') and new['throughput_per_s']:
+        comparison['throughput_ratio'] = round(new['throughput_per_s'] / old['throughput_per_s'], 2)
+    return comparison
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent checkout benchmark for the active database profile. Run it once per "
+        "profile (e.g. SQLite first with --output, then DB_ENGINE=postgres with --baseline "
+        "pointing at that file) to get the PostgreSQL vs SQLite comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=400, help="Checkouts to run in total.")
+        parser.add_argument('--cart-size', type=int, default=5)
+        parser.add_argument('--output', help="Also write the JSON result to this file.")
+        parser.add_argument('--baseline', help="JSON result of a run on another profile to compare against.")
+
+    def handle(self, *args, threads, orders, cart_size, output, baseline, **options):
+        with scratch_database():
+            profile = database_profile()
+            products = seed_products(max(cart_size, 10))
+            users = seed_users(orders)
+            fill_carts(users, products, cart_size)
+
+            def checkout(user):
+                return lambda: place_order(user, BillingDetails(
+                    phone_number='9999999999', Full_name='Bench User', Address='Bench street',
+                ))
+
+            latencies, errors, elapsed = run_concurrently([checkout(user) for user in users], threads)
+
+        result = {
+            'benchmark': 'checkout_db',
+            'revision': git_revision(),
+            'profile': profile,
+            'threads': threads,
+            'cart_size': cart_size,
+            'checkout': summarize(latencies, elapsed, len(errors)),
+            'error_samples': sorted({repr(exc) for exc in errors})[:5],
+        }
+        if baseline:
+            with open(baseline) as handle:
+                result['comparison'] = compare(json.load(handle), result)
+
+        text = json.dumps(result, indent=2)
+        if output:
+            with open(output, 'w') as handle:
+                handle.write(text + '\n')
+        self.stdout.write(text)
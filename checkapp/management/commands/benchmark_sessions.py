@@ -0,0 +1,56 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from checkapp.benchmarks import (
+    SESSION_PROFILES, database_profile, git_revision, run_session_overhead, scratch_database, seed_products,
+    seed_shoppers,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request cost of sessions and the logged-in user lookup on cart_view "
+        "and order_history under each session profile (database sessions + ModelBackend vs "
+        "cached sessions + CachedModelBackend), and print queries and time saved as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=20, help="Requests per user and page.")
+        parser.add_argument('--cart-size', type=int, default=3)
+        parser.add_argument(
+            '--profiles', default='db,cached_db',
+            help=f"Comma-separated, first one is the baseline. Choices: {', '.join(SESSION_PROFILES)}.",
+        )
+        parser.add_argument('--output', help="Also write the JSON result to this file.")
+
+    def handle(self, *args, users, requests, cart_size, profiles, output, **options):
+        profiles = tuple(profiles.split(','))
+        unknown = set(profiles) - set(SESSION_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profile(s): {', '.join(sorted(unknown))}")
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        with scratch_database(), override_settings(ALLOWED_HOSTS=hosts):
+            profile = database_profile()
+            products = seed_products(cart_size)
+            shoppers = seed_shoppers(users, products)
+            run = run_session_overhead(shoppers, products, requests, profiles)
+
+        result = {
+            'benchmark': 'session_overhead',
+            'revision': git_revision(),
+            'profile': profile,
+            'cache_backend': settings.CACHES['default']['BACKEND'],
+            'users': users,
+            'requests': requests,
+            **run,
+        }
+        text = json.dumps(result, indent=2)
+        if output:
+            with open(output, 'w') as handle:
+                handle.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from checkapp.benchmarks import (
+    database_profile, git_revision, run_flash_sale, scratch_database, seed_products, seed_users,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Flash-sale contention benchmark: many buyers check out the same product at once "
+        "through the checkout view, first with the product untracked (the checkout flow "
+        "without reservations), then with limited stock on each shard count. Prints "
+        "throughput, latency percentiles, units sold and an oversell check as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=50, help="Units on sale in the stock-tracked runs.")
+        parser.add_argument('--shards', default='1,8', help="Comma-separated shard counts to compare.")
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--output', help="Also write the JSON result to this file.")
+
+    def handle(self, *args, buyers, stock, shards, threads, output, **options):
+        fake_gateway = {**settings.PAYMENT_GATEWAY, 'BACKEND': 'checkapp.gateway.FakeGateway'}
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        scenarios = [(None, None)] + [(stock, int(count)) for count in shards.split(',')]
+
+        runs = []
+        with scratch_database(), override_settings(PAYMENT_GATEWAY=fake_gateway, ALLOWED_HOSTS=hosts):
+            profile = database_profile()
+            for n, (units, shard_count) in enumerate(scenarios):
+                product = seed_products(1)[0]
+                users = seed_users(buyers, prefix=f'sale{n}-')
+                runs.append(run_flash_sale(users, product, threads, stock=units, shards=shard_count))
+
+        result = {
+            'benchmark': 'flash_sale',
+            'revision': git_revision(),
+            'profile': profile,
+            'buyers': buyers,
+            'threads': threads,
+            'runs': runs,
+        }
+        text = json.dumps(result, indent=2)
+        if output:
+            with open(output, 'w') as handle:
+                handle.write(text + '\n')
+        self.stdout.write(text)
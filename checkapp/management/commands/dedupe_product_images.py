@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from checkapp.cache import bump_catalogue_version
+from checkapp.images import generate_derivatives
+from checkapp.models import Product
+from checkapp.storage import product_image_storage
+
+
+class Command(BaseCommand):
+    help = "Re-store existing Product images under content-hash names so duplicates share one file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--derivatives', action='store_true', help="Also build thumbnail/WebP variants.")
+
+    def handle(self, *args, batch_size, derivatives, **options):
+        changed, originals = [], set()
+        for product in Product.objects.only('id', 'image').iterator(chunk_size=batch_size):
+            if not product.image:
+                continue
+            old_name = product.image.name
+            try:
+                with product_image_storage.open(old_name, 'rb') as content:
+                    new_name = product_image_storage.save(old_name, content)
+            except OSError as exc:
+                self.stderr.write(f"Product {product.id}: {exc}")
+                continue
+            if new_name != old_name:
+                originals.add(old_name)
+                product.image.name = new_name
+                changed.append(product)
+            if derivatives:
+                generate_derivatives(product.image)
+
+        Product.objects.bulk_update(changed, ['image'], batch_size=batch_size)
+        bump_catalogue_version()  # bulk_update sends no save signals
+        self.stdout.write(f"Repointed {len(changed)} product(s); {len(originals)} old file(s) can now be removed:")
+        for name in sorted(originals):
+            self.stdout.write(f"  {name}")
@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from checkapp.metrics import metrics_snapshot, reset_metrics, summarize
+
+
+class Command(BaseCommand):
+    help = "Print per-URL-name latency percentiles and per-request query/template/gateway costs as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw', action='store_true', help="Print the merged histograms instead of the summary.")
+        parser.add_argument('--reset', action='store_true', help="Clear the collected metrics afterwards.")
+
+    def handle(self, *args, raw, reset, **options):
+        snapshot = metrics_snapshot()
+        self.stdout.write(json.dumps(snapshot if raw else summarize(snapshot), indent=2))
+        if reset:
+            reset_metrics()
@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from checkapp.feeds import FORMATS, export_rows, guess_format
+
+
+class Command(BaseCommand):
+    help = "Write every product as a CSV or JSON Lines feed that import_products can read back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write; stdout when omitted.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the output extension, else csv.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, output, format, chunk_size, **options):
+        fmt = format or (guess_format(output) if output else 'csv')
+        lines = export_rows(fmt, chunk_size=chunk_size)
+        if output:
+            with open(output, 'w', newline='', encoding='utf-8') as stream:
+                stream.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
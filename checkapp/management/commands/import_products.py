@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from checkapp.feeds import FORMATS, FeedError, ProductImporter, guess_format, read_rows
+from checkapp.images import generate_derivatives
+from checkapp.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or JSON Lines feed (columns: sku, name, price, "
+        "description, image), matched on sku, in batches and in bounded memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file, or - for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--images', dest='image_dir', help="Directory the image column refers to.")
+        parser.add_argument('--derivatives', action='store_true', help="Also build thumbnail/WebP variants.")
+
+    def handle(self, *args, path, format, batch_size, image_dir, derivatives, **options):
+        fmt = format or guess_format(path)
+        if fmt not in FORMATS:
+            raise CommandError(f"Cannot tell the feed format of {path}; pass --format.")
+
+        def progress(report):
+            self.stderr.write(f"  {report}")
+
+        importer = ProductImporter(batch_size=batch_size, image_dir=image_dir)
+        try:
+            if path == '-':
+                report = importer.run(read_rows(sys.stdin, fmt), progress)
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    report = importer.run(read_rows(stream, fmt), progress)
+        except (OSError, FeedError, ValueError) as exc:
+            raise CommandError(f"Import stopped: {exc}") from exc
+
+        for error in report.errors:
+            self.stderr.write(f"  {error}")
+        if derivatives:
+            # Variants that already exist are skipped, so this only renders new pictures
+            for product in Product.objects.exclude(image='').only('id', 'image').iterator(chunk_size=batch_size):
+                generate_derivatives(product.image)
+        self.stdout.write(str(report))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkapp.services import process_payment_events
+
+
+class Command(BaseCommand):
+    help = "Apply queued Razorpay callbacks/webhooks to order statuses in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new events.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        total = 0
+        while True:
+            processed = process_payment_events(batch_size)
+            total += processed
+            if processed:
+                continue
+            if not loop:
+                break
+            time.sleep(interval)
+        self.stdout.write(f"Processed {total} payment event(s).")
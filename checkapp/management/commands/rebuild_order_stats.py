@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from checkapp.stats import rebuild_order_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute UserOrderStats from the orders table (all users, or only --user ids)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help="Only this user id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, user_ids, batch_size, **options):
+        with transaction.atomic():
+            written = rebuild_order_stats(user_ids, batch_size=batch_size)
+        self.stdout.write(f"Rebuilt order stats for {written} user(s).")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from checkapp.search import rebuild_index, uses_fts_table
+
+
+class Command(BaseCommand):
+    help = "Refill the SQLite FTS5 product search index from the products table."
+
+    def handle(self, *args, **options):
+        if not uses_fts_table():
+            self.stdout.write("Nothing to do: this database maintains its search index itself.")
+            return
+        with transaction.atomic():
+            indexed = rebuild_index()
+        self.stdout.write(f"Indexed {indexed} product(s).")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkapp.services import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Mark unpaid orders whose stock reservations expired as Payment Failed and put their units back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help="Keep checking for expired reservations.")
+        parser.add_argument('--interval', type=float, default=30.0, help="Seconds to sleep when nothing has expired.")
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        total = 0
+        while True:
+            failed = release_expired_reservations(batch_size)
+            total += failed
+            if failed:
+                continue
+            if not loop:
+                break
+            time.sleep(interval)
+        self.stdout.write(f"Released the stock of {total} expired order(s).")
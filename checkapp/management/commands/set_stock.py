@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from checkapp.models import Product
+from checkapp.stock import get_options, set_stock
+
+
+class Command(BaseCommand):
+    help = "Set the units on sale for a product (by id or --sku), spread over its stock shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('product', help="Product id, or sku with --sku.")
+        parser.add_argument('quantity', type=int)
+        parser.add_argument('--sku', action='store_true', help="PRODUCT is a sku.")
+        parser.add_argument('--shards', type=int, help=f"Counter rows (default: STOCK['SHARDS'], {get_options()['SHARDS']}).")
+
+    def handle(self, *args, product, quantity, sku, shards, **options):
+        if quantity < 0 or (shards is not None and shards < 1):
+            raise CommandError("quantity must be >= 0 and shards >= 1")
+        try:
+            item = Product.objects.get(**{'sku' if sku else 'pk': product})
+        except (Product.DoesNotExist, ValueError):
+            raise CommandError(f"No product {product!r}") from None
+        set_stock(item, quantity, shards)
+        self.stdout.write(f"{item.name}: {quantity} unit(s) on sale.")
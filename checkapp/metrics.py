@@ -0,0 +1,300 @@
+"""
+Per-request performance metrics.
+
+PerformanceMiddleware gives every request a RequestMetrics object (held in a
+context variable, so it follows the request into async views and the threads
+the async ORM runs in). Three hooks fill it in:
+
+- SQL: a database execute wrapper installed on each new connection (see
+  signals.py) counts queries and their time.
+- Templates: the TimedDjangoTemplates backend times every top-level render.
+- Gateway: checkapp.gateway wraps each outbound call in timed('gateway').
+
+The totals go out as a Server-Timing header and into per-URL-name latency
+histograms. Each process keeps its own histograms and copies them to the
+cache every FLUSH_INTERVAL seconds; metrics_snapshot() merges every worker's
+copy for the /metrics/ endpoint and the dump_request_metrics command.
+Outside a request the hooks only do one context variable lookup.
+"""
+import contextvars
+import math
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.utils.decorators import sync_and_async_middleware
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 10,   # seconds between copies of this worker's histograms to the cache
+    'WORKER_TTL': 60 * 60 * 24,
+    'TOKEN': '',            # bearer token for scrapers; staff users can always read /metrics/
+}
+
+KINDS = ('db', 'template', 'gateway')
+
+WORKERS_KEY = 'perf:workers'
+
+# Latency buckets grow by 2**(1/4) (~19%) from 1ms up to about 17 minutes
+BUCKETS_PER_DOUBLING = 4
+MAX_BUCKET = 20 * BUCKETS_PER_DOUBLING
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'PERF_METRICS', {})}
+
+
+class RequestMetrics:
+    __slots__ = ('counts', 'durations')
+
+    def __init__(self):
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.durations = dict.fromkeys(KINDS, 0.0)
+
+    def add(self, kind, seconds):
+        self.counts[kind] += 1
+        self.durations[kind] += seconds
+
+    def server_timing(self, total):
+        parts = [
+            f'{kind};dur={self.durations[kind] * 1000:.1f};desc="{self.counts[kind]}"'
+            for kind in KINDS if self.counts[kind]
+        ]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+_current = contextvars.ContextVar('checkapp_request_metrics', default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timed(kind):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(kind, time.perf_counter() - start)
+
+
+def record_sql(execute, sql, params, many, context):
+    """Database execute wrapper; installed on every connection by signals.py."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add('db', time.perf_counter() - start)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The standard Django template backend, with render time recorded per request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+# --- Histograms ---
+
+def bucket_index(ms):
+    if ms <= 1:
+        return 0
+    return min(MAX_BUCKET, math.ceil(math.log2(ms) * BUCKETS_PER_DOUBLING))
+
+
+def bucket_bound(index):
+    return 2 ** (index / BUCKETS_PER_DOUBLING)
+
+
+def empty_stats():
+    return {
+        'count': 0,
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'buckets': {},
+        **{f'{kind}_count': 0 for kind in KINDS},
+        **{f'{kind}_ms': 0.0 for kind in KINDS},
+    }
+
+
+def merge_stats(into, stats):
+    for key, value in stats.items():
+        if key == 'buckets':
+            for index, count in value.items():
+                into['buckets'][index] = into['buckets'].get(index, 0) + count
+        elif key == 'max_ms':
+            into['max_ms'] = max(into['max_ms'], value)
+        else:
+            into[key] += value
+    return into
+
+
+def bucket_percentile(buckets, count, q):
+    """Upper bound (ms) of the bucket holding the q-th fraction of requests."""
+    if not count:
+        return None
+    seen = 0
+    for index in sorted(buckets, key=int):
+        seen += buckets[index]
+        if seen >= q * count:
+            return round(bucket_bound(int(index)), 1)
+    return round(bucket_bound(MAX_BUCKET), 1)
+
+
+class MetricsStore:
+    """This process's histograms, keyed by URL name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_flush = time.monotonic()
+
+    @property
+    def worker_key(self):
+        # Looked up each time so workers forked after import get their own key
+        return f'perf:worker:{socket.gethostname()}:{os.getpid()}'
+
+    def record(self, name, metrics, total):
+        ms = total * 1000
+        # JSON-friendly string keys, so cached and local snapshots merge the same way
+        index = str(bucket_index(ms))
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = empty_stats()
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['buckets'][index] = stats['buckets'].get(index, 0) + 1
+            for kind in KINDS:
+                stats[f'{kind}_count'] += metrics.counts[kind]
+                stats[f'{kind}_ms'] += metrics.durations[kind] * 1000
+
+    def snapshot(self):
+        with self._lock:
+            return {name: merge_stats(empty_stats(), stats) for name, stats in self._stats.items()}
+
+    def flush(self, options, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_flush < options['FLUSH_INTERVAL']:
+            return
+        self._last_flush = now
+        cache.set(self.worker_key, self.snapshot(), timeout=options['WORKER_TTL'])
+        workers = cache.get(WORKERS_KEY) or []
+        if self.worker_key not in workers:
+            # A lost race only delays this worker's entry to its next flush
+            cache.set(WORKERS_KEY, workers + [self.worker_key], timeout=options['WORKER_TTL'])
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+store = MetricsStore()
+
+
+def metrics_snapshot():
+    """Merge every worker's histograms (this process's are always up to date)."""
+    workers = cache.get(WORKERS_KEY) or []
+    snapshots = cache.get_many(workers)
+    snapshots[store.worker_key] = store.snapshot()
+
+    merged = {}
+    for snapshot in snapshots.values():
+        for name, stats in snapshot.items():
+            merge_stats(merged.setdefault(name, empty_stats()), stats)
+    return merged
+
+
+def summarize(snapshot):
+    summary = {}
+    for name, stats in sorted(snapshot.items()):
+        count = stats['count']
+        if not count:
+            continue
+        summary[name] = {
+            'count': count,
+            'mean_ms': round(stats['total_ms'] / count, 2),
+            'p50_ms': bucket_percentile(stats['buckets'], count, 0.50),
+            'p95_ms': bucket_percentile(stats['buckets'], count, 0.95),
+            'p99_ms': bucket_percentile(stats['buckets'], count, 0.99),
+            'max_ms': round(stats['max_ms'], 2),
+            **{f'{kind}_per_request': round(stats[f'{kind}_count'] / count, 2) for kind in KINDS},
+            **{f'{kind}_ms_per_request': round(stats[f'{kind}_ms'] / count, 2) for kind in KINDS},
+        }
+    return summary
+
+
+def reset_metrics():
+    store.reset()
+    workers = cache.get(WORKERS_KEY) or []
+    cache.delete_many(workers + [WORKERS_KEY])
+
+
+# --- Middleware ---
+
+@sync_and_async_middleware
+def PerformanceMiddleware(get_response):
+    """Records per-request SQL, template and gateway time; sets Server-Timing."""
+    options = get_options()
+    if not options['ENABLED']:
+        raise MiddlewareNotUsed
+
+    def start():
+        return _current.set(RequestMetrics()), time.perf_counter()
+
+    def finish(request, response, token, started):
+        total = time.perf_counter() - started
+        metrics = _current.get()
+        _current.reset(token)
+        match = request.resolver_match
+        name = match.view_name if match else '<unresolved>'
+        response['Server-Timing'] = metrics.server_timing(total)
+        store.record(name, metrics, total)
+        store.flush(options)
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, started = start()
+            response = await get_response(request)
+            return finish(request, response, token, started)
+    else:
+        def middleware(request):
+            token, started = start()
+            response = get_response(request)
+            return finish(request, response, token, started)
+
+    return middleware
+
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkapp', '0006_billingdetails_user_cartitem_user_order_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_amount',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_currency',
+            field=models.CharField(blank=True, default='', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
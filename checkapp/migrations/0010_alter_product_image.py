@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:20
+
+import checkapp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkapp', '0009_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(storage=checkapp.storage.get_product_image_storage, upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold duplicate (user, product) cart rows into the oldest one, summing quantities."""
+    CartItem = apps.get_model('checkapp', 'CartItem')
+
+    # Rows from before CartItem.user existed can't belong to anyone's cart
+    CartItem.objects.filter(user__isnull=True).delete()
+
+    duplicates = (
+        CartItem.objects.values('user', 'cartproduct')
+        .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for group in duplicates:
+        CartItem.objects.filter(id=group['keep']).update(quantity=group['total'])
+        CartItem.objects.filter(
+            user=group['user'], cartproduct=group['cartproduct']
+        ).exclude(id=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkapp', '0010_alter_product_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'cartproduct'), name='unique_cart_line'),
+        ),
+    ]
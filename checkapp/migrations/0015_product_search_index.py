@@ -0,0 +1,42 @@
+from django.db import migrations
+
+FTS_TABLE = 'checkapp_product_fts'
+
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        # prefix='3' indexes 3-letter prefixes, so "dre*" style queries stay index lookups
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"name, description, tokenize='unicode61 remove_diacritics 2', prefix='3')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) SELECT id, name, description FROM checkapp_product"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"CREATE INDEX product_search_idx ON checkapp_product USING GIN (({PG_VECTOR}))")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkapp', '0014_product_sku'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,64 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def _receipt(order):
+    # Version 1 of the receipt document (checkapp/receipts.py), frozen here
+    billing = order.billing_details
+    lines = [
+        {
+            'product_id': item.product_id,
+            'name': item.product.name,
+            'image': item.product.image.name or '',
+            'price': str(item.price),
+            'quantity': item.quantity,
+            'total': str(item.price * item.quantity),
+        }
+        for item in order.items.all()
+    ]
+    return {
+        'v': 1,
+        'order_id': order.pk,
+        'placed_at': order.order_date.isoformat(),
+        'billing': {'name': billing.Full_name, 'phone': billing.phone_number, 'address': billing.Address},
+        'lines': lines,
+        'total_quantity': order.total_quantity,
+        'total_price': str(order.total_price),
+    }
+
+
+def snapshot_existing_orders(apps, schema_editor):
+    Order = apps.get_model('checkapp', 'Order')
+    OrderItem = apps.get_model('checkapp', 'OrderItem')
+    OrderReceipt = apps.get_model('checkapp', 'OrderReceipt')
+    orders = Order.objects.select_related('billing_details').prefetch_related(
+        models.Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id'))
+    ).order_by('id')
+    batch = []
+    for order in orders.iterator(chunk_size=BATCH_SIZE):
+        batch.append(OrderReceipt(order=order, data=_receipt(order)))
+        if len(batch) == BATCH_SIZE:
+            OrderReceipt.objects.bulk_create(batch)
+            batch = []
+    OrderReceipt.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkapp', '0016_order_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderReceipt',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='receipt', serialize=False, to='checkapp.order')),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(snapshot_existing_orders, migrations.RunPython.noop),
+    ]
@@ -1,25 +1,62 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
+from .storage import get_product_image_storage
+
+MONEY = models.DecimalField(max_digits=12, decimal_places=2)
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('cartproduct__price'), output_field=MONEY)
+
 class Product(models.Model):
+    # Natural key for product feeds (import_products / export_products); optional for hand-made products
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
-    image = models.ImageField(upload_to='products/')
+    image = models.ImageField(upload_to='products/', storage=get_product_image_storage)  # content-hash named
+    updated_at = models.DateTimeField(auto_now=True)  # drives product page ETag / Last-Modified
 
     def __str__(self):
         return self.name
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_products(self):
+        """Join the product in and let the database compute each line total."""
+        return self.select_related('cartproduct').annotate(line_total=LINE_TOTAL)
+
+    def totals(self):
+        """Grand total and number of items for these lines, in one aggregate query."""
+        return self.aggregate(
+            total_amount=Coalesce(Sum(LINE_TOTAL), Value(Decimal('0.00')), output_field=MONEY),
+            item_count=Coalesce(Sum('quantity'), Value(0)),
+        )
+
+
 class CartItem(models.Model):
     # Keeping your original field name to avoid breaking existing code
-    user = models.ForeignKey(User,on_delete=models.CASCADE)
+    # (no separate index: unique_cart_line starts with user)
+    user = models.ForeignKey(User,on_delete=models.CASCADE, db_index=False)
 
     cartproduct = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One line per product per user; cart code relies on this for lock-free upserts
+            models.UniqueConstraint(fields=['user', 'cartproduct'], name='unique_cart_line'),
+        ]
+
     @property
     def total_cost(self):
+        # Computed by the database when loaded through with_products()
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.quantity * self.cartproduct.price
 
     def __str__(self):
@@ -39,7 +76,8 @@ class BillingDetails(models.Model):
 
 class Order(models.Model):
     # Link order to billing details instead of storing name/address separately
-    user = models.ForeignKey(User, on_delete=models.CASCADE,null=True,blank=True)
+    # (no separate index: order_user_date_idx starts with user)
+    user = models.ForeignKey(User, on_delete=models.CASCADE,null=True,blank=True, db_index=False)
 
     billing_details = models.ForeignKey(
         BillingDetails,
@@ -54,8 +92,23 @@ class Order(models.Model):
 
     status = models.CharField(max_length=50, default="Pending")
 
+    # Razorpay order created for this Order; reused on every later confirmation render
+    razorpay_order_id = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    razorpay_amount = models.PositiveIntegerField(null=True, blank=True)  # in paise
+    razorpay_currency = models.CharField(max_length=3, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # Order history: WHERE user = ? ORDER BY order_date DESC, id DESC (keyset pages)
+            models.Index(fields=['user', '-order_date', '-id'], name='order_user_date_idx'),
+            # Status filters (admin, payment reconciliation), newest first
+            models.Index(fields=['status', '-order_date'], name='order_status_date_idx'),
+            # Admin changelist: newest first, optionally narrowed to a date range
+            models.Index(fields=['-order_date', '-id'], name='order_date_idx'),
+        ]
+
     def __str__(self):
-        return f"Order {self.id} - {self.billing_details.Full_name} - {self.status}"
+        return f"Order {self.id} - {self.status}"  # no billing lookup; the name is on the receipt
 
 
 class OrderItem(models.Model):
@@ -74,13 +127,143 @@ class OrderItem(models.Model):
     # Store price at the moment of order (if product price changes later, order remains correct)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Items of an order in insertion order (first-item summaries, receipts)
+            models.Index(fields=['order', 'id'], name='orderitem_order_id_idx'),
+        ]
+
     @property
     def total_cost(self):
         return self.quantity * self.price
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} for Order {self.order.id}"
-    
+        return f"{self.quantity} x product {self.product_id} for Order {self.order_id}"
+
+
+class OrderReceipt(models.Model):
+    """
+    What the customer bought, frozen when the order was placed: line names,
+    images, prices and quantities, the delivery address and the totals as one
+    JSON document (see checkapp/receipts.py). Written once, never updated.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='receipt')
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order receipts are immutable")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Receipt for Order {self.order_id}"
+
+
+class PaymentEvent(models.Model):
+    """
+    A payment callback or webhook from Razorpay, stored as soon as its signature
+    checks out. The process_payment_events command applies the status changes
+    in batches; the unique payment id makes replayed events no-ops.
+    """
+    SOURCE_CALLBACK = "callback"
+    SOURCE_WEBHOOK = "webhook"
+
+    razorpay_payment_id = models.CharField(max_length=64, unique=True)
+    razorpay_order_id = models.CharField(max_length=64)
+    status = models.CharField(max_length=50)  # Order status to apply, e.g. "Paid"
+    source = models.CharField(max_length=20)
+    payload = models.JSONField(default=dict, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['id'],
+                condition=models.Q(processed_at__isnull=True),
+                name='paymentevent_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.razorpay_payment_id} -> {self.status}"
+
+
+class StockShard(models.Model):
+    """
+    One slice of a product's available units. A product's stock is spread
+    over several shards (see checkapp/stock.py) so concurrent buyers decrement
+    different rows instead of queueing on one. Products without shards are
+    not stock-tracked. `available` may go negative only when a payment arrives
+    for a reservation that had already expired (an oversell to follow up).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField()
+    available = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='stockshard_product_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.available}"
+
+
+class StockReservation(models.Model):
+    """
+    Units taken out of stock for one order line. Held until the order is paid
+    (committed) or fails / expires (released: the units go back to a shard).
+    """
+    HELD = "held"
+    COMMITTED = "committed"
+    RELEASED = "released"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    state = models.CharField(max_length=10, default=HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # release_expired_reservations: held reservations, oldest expiry first
+            models.Index(fields=['expires_at'], condition=models.Q(state="held"), name='reservation_held_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for Order {self.order_id} ({self.state})"
+
+
+class UserOrderStats(models.Model):
+    """
+    Per-user order totals, kept up to date by checkapp/stats.py whenever an
+    order is placed or changes status, so account pages and the admin read
+    them with one primary-key lookup. rebuild_order_stats recomputes them.
+    """
+    # Order status -> the counter that tracks it
+    STATUS_COUNTERS = {
+        "Pending": 'pending_count',
+        "Paid": 'paid_count',
+        "Payment Failed": 'failed_count',
+    }
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='order_stats')
+    order_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))  # Paid orders only
+    last_order_date = models.DateTimeField(null=True, blank=True)
+    pending_count = models.PositiveIntegerField(default=0)
+    paid_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "user order stats"
+
+    def __str__(self):
+        return f"{self.user} - {self.order_count} orders"
 
 
 from django.contrib.auth.models import User
@@ -0,0 +1,89 @@
+import base64
+import json
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str | None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _plain(value):
+    # Full-precision isoformat: DjangoJSONEncoder drops microseconds, which breaks key equality
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_plain(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the list of key values stored in a cursor, or None if it is not valid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after_cursor(queryset, keys, cursor):
+    fields = [key.lstrip('-') for key in keys]
+    queryset = queryset.order_by(*keys)
+
+    values = decode_cursor(cursor) if cursor else None
+    if values is not None and len(values) == len(keys):
+        condition = Q()
+        for i, key in enumerate(keys):
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            step = Q(**{f'{fields[i]}__{lookup}': values[i]})
+            for field, value in zip(fields[:i], values[:i]):
+                step &= Q(**{field: value})
+            condition |= step
+        try:
+            queryset = queryset.filter(condition)
+        except (ValidationError, ValueError, TypeError):
+            # A tampered cursor just falls back to the first page
+            pass
+    return queryset, fields
+
+
+def _page(items, fields, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field) for field in fields])
+    return KeysetPage(items, next_cursor)
+
+
+def keyset_page(queryset, keys, cursor=None, page_size=20):
+    """
+    Return one page of `queryset` ordered by `keys`, e.g. ('-order_date', '-id').
+
+    Instead of OFFSET, the page starts right after the row the cursor points
+    at, so every page costs the same however deep the user scrolls. The last
+    key must be unique (normally the primary key) to keep the order total.
+    """
+    queryset, fields = _after_cursor(queryset, keys, cursor)
+    return _page(list(queryset[:page_size + 1]), fields, page_size)
+
+
+async def akeyset_page(queryset, keys, cursor=None, page_size=20):
+    """keyset_page() for async views."""
+    queryset, fields = _after_cursor(queryset, keys, cursor)
+    return _page([item async for item in queryset[:page_size + 1]], fields, page_size)
@@ -0,0 +1,126 @@
+"""
+Order receipts: an immutable snapshot of what was bought, written once by
+place_order() in the same transaction as the order.
+
+The snapshot holds everything the confirmation page, the order history and
+the admin show about an order (line names, images, prices, quantities, the
+delivery address and the totals) as one compact JSON document in its own
+OrderReceipt row. Pages read it alongside the order with a single-row join
+instead of walking OrderItem -> Product and BillingDetails, and renaming or
+repricing a product later does not change what an old order shows.
+
+Only the order's status and gateway fields live on Order and keep changing.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.utils.functional import cached_property
+
+from .models import OrderReceipt, Product
+
+RECEIPT_VERSION = 1
+
+CENT = Decimal('0.01')
+
+
+def _money(value):
+    return str(Decimal(value).quantize(CENT))
+
+
+def _line(product_id, name, image, price, quantity):
+    return {
+        'product_id': product_id,
+        'name': name,
+        'image': image or '',
+        'price': _money(price),
+        'quantity': quantity,
+        'total': _money(price * quantity),
+    }
+
+
+def build_receipt(order, billing_details, lines):
+    """
+    The receipt document for `order`. `lines` yields one
+    (product_id, name, image name, unit price, quantity) tuple per order line.
+    """
+    return {
+        'v': RECEIPT_VERSION,
+        'order_id': order.pk,
+        'placed_at': order.order_date.isoformat(),
+        'billing': {
+            'name': billing_details.Full_name,
+            'phone': billing_details.phone_number,
+            'address': billing_details.Address,
+        },
+        'lines': [_line(*line) for line in lines],
+        'total_quantity': order.total_quantity,
+        'total_price': _money(order.total_price),
+    }
+
+
+def snapshot_cart(order, billing_details, cart_items):
+    """Write the receipt for an order placed from `cart_items` (products joined in)."""
+    return OrderReceipt.objects.create(order=order, data=build_receipt(order, billing_details, (
+        (item.cartproduct_id, item.cartproduct.name, item.cartproduct.image.name, item.cartproduct.price, item.quantity)
+        for item in cart_items
+    )))
+
+
+@dataclass(frozen=True)
+class ReceiptLine:
+    product_id: int
+    name: str
+    image: object  # an ImageFieldFile, so the responsive_image tag works on it
+    price: Decimal
+    quantity: int
+    total_cost: Decimal
+
+
+@dataclass(frozen=True)
+class Delivery:
+    Full_name: str
+    phone_number: str
+    Address: str
+
+
+class Receipt:
+    """Read-only view of a receipt document with the types templates expect."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @cached_property
+    def lines(self):
+        field = Product._meta.get_field('image')
+        return [
+            ReceiptLine(
+                product_id=line['product_id'],
+                name=line['name'],
+                image=field.attr_class(None, field, line['image']) if line['image'] else None,
+                price=Decimal(line['price']),
+                quantity=line['quantity'],
+                total_cost=Decimal(line['total']),
+            )
+            for line in self.data['lines']
+        ]
+
+    @property
+    def first_line(self):
+        return self.lines[0] if self.lines else None
+
+    @property
+    def item_count(self):
+        return len(self.data['lines'])
+
+    @cached_property
+    def delivery(self):
+        billing = self.data['billing']
+        return Delivery(billing['name'], billing['phone'], billing['address'])
+
+    @property
+    def total_price(self):
+        return Decimal(self.data['total_price'])
+
+    @property
+    def total_quantity(self):
+        return self.data['total_quantity']
@@ -0,0 +1,169 @@
+"""
+Full-text product search.
+
+SQLite: an FTS5 table (checkapp_product_fts, rowid = product id) holds a copy
+of each product's name and description. signals.py keeps it in step with
+Product saves and deletes; bulk writes call index_products() themselves and
+the rebuild_search_index command repairs it wholesale.
+
+PostgreSQL: a GIN index on a weighted to_tsvector() expression over the
+product columns. The database maintains it, so nothing needs syncing.
+
+Both are created by migration 0015. Results are ranked (name matches weigh
+more than description matches), the last word is matched as a prefix so
+partial input already finds products, and pages are keyset-paginated on
+(score, id). Other databases fall back to a plain icontains filter.
+"""
+import math
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+from .pagination import KeysetPage, decode_cursor, encode_cursor
+
+FTS_TABLE = 'checkapp_product_fts'
+
+# Name matches count ten times as much as description matches
+NAME_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 1.0
+
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
+MAX_TERMS = 8
+# Cursor ids go to the database as 64-bit integers
+MAX_ID = 2 ** 63 - 1
+
+# Shorter trailing words are matched whole: a one- or two-letter prefix matches
+# so much of a large catalogue that ranking it would dominate the query time
+MIN_PREFIX = 3
+
+
+def search_terms(query):
+    """Words of the query; everything else (FTS operators, quotes) is dropped."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _is_prefix(term):
+    return len(term) >= MIN_PREFIX
+
+
+def _fts5_query(terms):
+    words = [f'"{term}"' for term in terms]
+    if _is_prefix(terms[-1]):
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def _tsquery(terms):
+    return ' & '.join(terms[:-1] + [f'{terms[-1]}:*' if _is_prefix(terms[-1]) else terms[-1]])
+
+
+def _ranked_ids(terms, after, limit):
+    """(id, score) pairs best first; lower scores are better on every backend."""
+    if connection.vendor == 'sqlite':
+        inner = (
+            f"SELECT rowid AS id, bm25({FTS_TABLE}, %s, %s) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        )
+        params = [NAME_WEIGHT, DESCRIPTION_WEIGHT, _fts5_query(terms)]
+    else:
+        inner = (
+            f"SELECT id, -ts_rank({PG_VECTOR}, query) AS score "
+            f"FROM checkapp_product, to_tsquery('simple', %s) query WHERE ({PG_VECTOR}) @@ query"
+        )
+        params = [_tsquery(terms)]
+
+    sql = f"SELECT id, score FROM ({inner}) ranked"
+    if after:
+        sql += " WHERE score > %s OR (score = %s AND id > %s)"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY score, id LIMIT %s"
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _valid_cursor(values):
+    """A (score, id) cursor whose values the database accepts: a finite float and a 64-bit id."""
+    if not isinstance(values, list) or len(values) != 2:
+        return False
+    score, product_id = values
+    return (
+        type(score) is float and math.isfinite(score)
+        and type(product_id) is int and -MAX_ID - 1 <= product_id <= MAX_ID
+    )
+
+
+def search_products(query, queryset=None, cursor=None, page_size=20):
+    """
+    One page of products matching `query`, best match first, as a KeysetPage.
+    `queryset` picks the columns to load (defaults to all of them).
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    terms = search_terms(query)
+    if not terms:
+        return KeysetPage([], None)
+
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not _valid_cursor(after):
+        after = None  # a tampered cursor just falls back to the first page
+
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        condition = Q()
+        for term in terms:
+            condition &= Q(name__icontains=term) | Q(description__icontains=term)
+        items = list(queryset.filter(condition, id__gt=after[1] if after else 0).order_by('id')[:page_size + 1])
+        ranked = [(item.id, 0) for item in items]
+    else:
+        ranked = _ranked_ids(terms, after, page_size + 1)
+        products = queryset.in_bulk([product_id for product_id, _ in ranked])
+        # The index can briefly list a product deleted by another transaction
+        ranked = [(product_id, score) for product_id, score in ranked if product_id in products]
+        items = [products[product_id] for product_id, _ in ranked]
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([ranked[page_size - 1][1], ranked[page_size - 1][0]])
+    return KeysetPage(items, next_cursor)
+
+
+# --- Index upkeep (SQLite only; the PostgreSQL index maintains itself) ---
+
+def uses_fts_table():
+    return connection.vendor == 'sqlite'
+
+
+def index_products(products):
+    """(Re)index these products, e.g. after a bulk write that sent no signals."""
+    if not uses_fts_table() or not products:
+        return
+    rows = [(product.id, product.name, product.description) for product in products]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)", rows)
+
+
+def unindex_products(product_ids):
+    if not uses_fts_table() or not product_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+
+def rebuild_index():
+    """Refill the index from the products table in one statement. Returns the row count."""
+    if not uses_fts_table():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, name, description) SELECT id, name, description FROM checkapp_product")
+        indexed = cursor.rowcount
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")  # merge segments
+    return indexed
@@ -0,0 +1,267 @@
+import asyncio
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from . import stock
+from .gateway import get_gateway, has_long_lived_loop
+from .models import CartItem, Order, OrderItem, PaymentEvent
+from .receipts import snapshot_cart
+from .stats import record_order_placed, record_status_changes
+
+# Striped per-order locks: concurrent refreshes of one order wait for the first gateway call
+_ORDER_LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def place_order(user, billing_details):
+    """
+    Turn the user's cart into an Order in one transaction.
+
+    The cart is read once (products joined in), line totals are computed by
+    the database, every OrderItem is written with a single bulk_create, the
+    receipt snapshot is written as one row and the cart is cleared. The number
+    of queries does not depend on the cart size.
+
+    Units of stock-tracked products are reserved in the same transaction; if
+    one is sold out, stock.OutOfStock is raised and nothing is saved.
+
+    Returns the new Order, or None when the cart is empty (nothing is saved).
+    """
+    with transaction.atomic():
+        # Locking the cart lines makes a double-submitted checkout wait here and then
+        # find the cart empty, instead of both requests ordering the same lines.
+        # of=('self',): the joined product rows stay unlocked for other buyers.
+        cart_items = list(CartItem.objects.select_for_update(of=('self',)).filter(user=user).with_products())
+        if not cart_items:
+            return None
+
+        billing_details.user = user
+        billing_details.save()
+
+        order = Order.objects.create(
+            user=user,
+            billing_details=billing_details,
+            total_price=sum(item.line_total for item in cart_items),
+            total_quantity=sum(item.quantity for item in cart_items),
+            status="Pending",
+        )
+        stock.reserve(order, [(item.cartproduct_id, item.quantity) for item in cart_items])
+
+        # Price is copied from the product so the order stays correct if it changes later
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.cartproduct,
+                quantity=item.quantity,
+                price=item.cartproduct.price,
+            )
+            for item in cart_items
+        ])
+        snapshot_cart(order, billing_details, cart_items)
+
+        CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
+        record_order_placed(order)
+
+    return order
+
+
+GATEWAY_FIELDS = ['razorpay_order_id', 'razorpay_amount', 'razorpay_currency']
+
+
+def _has_gateway_order(order, amount, currency):
+    return bool(order.razorpay_order_id) and order.razorpay_amount == amount and order.razorpay_currency == currency
+
+
+def _copy_gateway_fields(source, target):
+    for field in GATEWAY_FIELDS:
+        setattr(target, field, getattr(source, field))
+    return target
+
+
+def ensure_gateway_order(order, currency="INR"):
+    """
+    Make sure `order` has a Razorpay order and return it.
+
+    The gateway order id, amount and currency are stored on the Order, so only
+    the first confirmation render talks to the gateway; later renders reuse the
+    stored id without any remote call. An in-process per-order lock makes
+    concurrent first renders share a single gateway call. The call itself is
+    made outside any transaction (on SQLite an open write transaction would
+    block every other writer for the whole round trip) and the id is stored
+    with a compare-and-set: if another process stored one first, its gateway
+    order is used instead. May raise PaymentGatewayError.
+    """
+    amount = int(order.total_price * 100)  # Razorpay works in paise
+    if _has_gateway_order(order, amount, currency):
+        return order
+
+    with _ORDER_LOCKS[order.pk % len(_ORDER_LOCKS)]:
+        stored = Order.objects.only(*GATEWAY_FIELDS).get(pk=order.pk)
+        if not _has_gateway_order(stored, amount, currency):
+            gateway_order = get_gateway().create_order(amount, currency, receipt=f"order_{order.pk}")
+            claimed = _claim_gateway_order(stored).update(
+                razorpay_order_id=gateway_order['id'], razorpay_amount=amount, razorpay_currency=currency
+            )
+            if claimed:
+                _set_gateway_fields(stored, gateway_order['id'], amount, currency)
+            else:
+                stored = Order.objects.only(*GATEWAY_FIELDS).get(pk=order.pk)
+
+    return _copy_gateway_fields(stored, order)
+
+
+def _claim_gateway_order(stored):
+    # Matches only while the row still holds the values read before the gateway call
+    return Order.objects.filter(pk=stored.pk, razorpay_order_id=stored.razorpay_order_id)
+
+
+def _set_gateway_fields(order, gateway_order_id, amount, currency):
+    order.razorpay_order_id = gateway_order_id
+    order.razorpay_amount = amount
+    order.razorpay_currency = currency
+
+
+# asyncio locks belong to one event loop, so each loop gets its own stripes
+_ASYNC_ORDER_LOCKS = weakref.WeakKeyDictionary()
+
+
+def _async_order_lock(pk):
+    loop = asyncio.get_running_loop()
+    if loop not in _ASYNC_ORDER_LOCKS:
+        _ASYNC_ORDER_LOCKS[loop] = [asyncio.Lock() for _ in range(len(_ORDER_LOCKS))]
+    return _ASYNC_ORDER_LOCKS[loop][pk % len(_ORDER_LOCKS)]
+
+
+async def aensure_gateway_order(order, currency="INR"):
+    """
+    Async version of ensure_gateway_order for async views.
+
+    Under ASGI the in-process lock is a per-loop asyncio lock and the gateway
+    call is awaited; the id is stored with the same compare-and-set. Without a
+    long-lived event loop the per-loop locks would not be shared between
+    requests, so the sync version (thread lock) runs in a thread instead.
+    """
+    amount = int(order.total_price * 100)
+    if _has_gateway_order(order, amount, currency):
+        return order
+    if not has_long_lived_loop():
+        return await sync_to_async(ensure_gateway_order)(order, currency)
+
+    async with _async_order_lock(order.pk):
+        stored = await Order.objects.only(*GATEWAY_FIELDS).aget(pk=order.pk)
+        if not _has_gateway_order(stored, amount, currency):
+            gateway_order = await get_gateway().acreate_order(amount, currency, receipt=f"order_{order.pk}")
+            claimed = await _claim_gateway_order(stored).aupdate(
+                razorpay_order_id=gateway_order['id'], razorpay_amount=amount, razorpay_currency=currency
+            )
+            if claimed:
+                _set_gateway_fields(stored, gateway_order['id'], amount, currency)
+            else:
+                stored = await Order.objects.only(*GATEWAY_FIELDS).aget(pk=order.pk)
+
+    return _copy_gateway_fields(stored, order)
+
+
+def _payment_event(payment_id, gateway_order_id, status, source, payload):
+    return PaymentEvent(
+        razorpay_payment_id=payment_id,
+        razorpay_order_id=gateway_order_id,
+        status=status,
+        source=source,
+        payload=payload or {},
+    )
+
+
+def record_payment_event(payment_id, gateway_order_id, status, source, payload=None):
+    """
+    Queue a verified payment result for process_payment_events.
+
+    This is a single INSERT; an event for a payment id that is already queued
+    (a replayed callback, or the webhook for the same payment) is ignored.
+    """
+    PaymentEvent.objects.bulk_create(
+        [_payment_event(payment_id, gateway_order_id, status, source, payload)], ignore_conflicts=True
+    )
+
+
+async def arecord_payment_event(payment_id, gateway_order_id, status, source, payload=None):
+    await PaymentEvent.objects.abulk_create(
+        [_payment_event(payment_id, gateway_order_id, status, source, payload)], ignore_conflicts=True
+    )
+
+
+def change_order_status(orders, status):
+    """
+    Set `status` on every order in the queryset with one UPDATE and adjust the
+    owners' UserOrderStats to match. Stock reserved for the orders is kept
+    when they become "Paid" and put back when they become "Payment Failed".
+    Returns the number of orders changed.
+    """
+    with transaction.atomic():
+        changed = list(
+            orders.exclude(status=status).select_for_update().values_list('id', 'user_id', 'status', 'total_price')
+        )
+        if not changed:
+            return 0
+        order_ids = [order_id for order_id, *_ in changed]
+        Order.objects.filter(id__in=order_ids).update(status=status)
+        record_status_changes(
+            (user_id, old_status, status, total_price) for _, user_id, old_status, total_price in changed
+        )
+        if status == "Paid":
+            stock.commit(order_ids)
+        elif status == "Payment Failed":
+            stock.release(order_ids)
+    return len(changed)
+
+
+def process_payment_events(batch_size=500):
+    """
+    Apply one batch of queued payment events to their orders.
+
+    Orders are matched on the stored Razorpay order id, so an event can only
+    change the order it was paid for. "Paid" wins over "Payment Failed" (a
+    failed attempt followed by a successful one) and is never downgraded.
+    Returns the number of events processed.
+    """
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        final_status = {}
+        for event in events:
+            if final_status.get(event.razorpay_order_id) != "Paid":
+                final_status[event.razorpay_order_id] = event.status
+
+        for status in set(final_status.values()):
+            gateway_order_ids = [key for key, value in final_status.items() if value == status]
+            change_order_status(
+                Order.objects.filter(razorpay_order_id__in=gateway_order_ids).exclude(status="Paid"), status
+            )
+
+        PaymentEvent.objects.filter(id__in=[event.id for event in events]).update(
+            processed_at=timezone.now()
+        )
+    return len(events)
+
+
+def release_expired_reservations(batch_size=500):
+    """
+    Fail unpaid orders whose stock reservations have expired, which puts their
+    units back on sale. Returns the number of orders failed.
+    """
+    order_ids = stock.expired_order_ids(limit=batch_size)
+    if not order_ids:
+        return 0
+    failed = change_order_status(Order.objects.filter(id__in=order_ids, status="Pending"), "Payment Failed")
+    stock.release(order_ids)  # held units of orders that had already left "Pending"
+    return failed
+
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import invalidate_user
+from .cache import bump_catalogue_version
+from .cart import merge_cart_on_login
+from .images import generate_derivatives
+from .metrics import record_sql
+from .search import index_products, unindex_products
+from .models import Product
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalogue(sender, **kwargs):
+    # After commit, so a reader can't re-cache the old rows under the new version
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(post_save, sender=Product)
+def build_image_derivatives(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(lambda: generate_derivatives(instance.image))
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    # Same transaction as the save, so the index never lists an uncommitted product
+    if not raw:
+        index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+
+
+@receiver(connection_created)
+def instrument_queries(sender, connection, **kwargs):
+    # execute_wrappers outlives reconnects, so only add the wrapper once
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Now for this request, and again after commit in case a reader re-cached the old row meanwhile
+    invalidate_user(instance.pk)
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    # Every login path (login_view, the admin, force_login) keeps the anonymous cart
+    if request is not None and hasattr(request, 'session'):
+        merge_cart_on_login(request, user)
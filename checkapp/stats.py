@@ -0,0 +1,119 @@
+"""
+Incremental upkeep of UserOrderStats.
+
+Call these inside the transaction that changes the orders, so the totals
+commit (or roll back) with them. Every change is a single UPDATE with F()
+expressions, so concurrent checkouts for one user never overwrite each
+other's counts. rebuild_order_stats() recomputes everything from Order and
+is what the rebuild_order_stats command runs.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import MONEY, Order, UserOrderStats
+
+PAID = "Paid"
+
+
+def _apply(user_id, deltas, last_order_date=None):
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if last_order_date is not None:
+        # Greatest() is NULL on SQLite when the column is NULL, hence the Coalesce
+        changes['last_order_date'] = Coalesce(
+            Greatest('last_order_date', Value(last_order_date)), Value(last_order_date)
+        )
+    if not changes:
+        return
+    if UserOrderStats.objects.filter(pk=user_id).update(**changes):
+        return
+    # No row yet (first order, or orders placed before the table existed): count
+    # this user's orders, which already include the change being recorded
+    row = _stats_rows(Order.objects.filter(user_id=user_id)).first()
+    if row is None:
+        return
+    try:
+        with transaction.atomic():
+            UserOrderStats.objects.create(**row)
+    except IntegrityError:
+        # A concurrent first order created the row without seeing ours
+        UserOrderStats.objects.filter(pk=user_id).update(**changes)
+
+
+def record_order_placed(order):
+    if order.user_id is None:
+        return
+    deltas = {'order_count': 1}
+    counter = UserOrderStats.STATUS_COUNTERS.get(order.status)
+    if counter:
+        deltas[counter] = 1
+    if order.status == PAID:
+        deltas['lifetime_spend'] = order.total_price
+    _apply(order.user_id, deltas, last_order_date=order.order_date)
+
+
+def record_status_changes(changes):
+    """`changes` holds (user_id, old status, new status, total_price) per changed order."""
+    per_user = defaultdict(lambda: defaultdict(int))
+    for user_id, old_status, new_status, total_price in changes:
+        if user_id is None or old_status == new_status:
+            continue
+        deltas = per_user[user_id]
+        if old_status in UserOrderStats.STATUS_COUNTERS:
+            deltas[UserOrderStats.STATUS_COUNTERS[old_status]] -= 1
+        if new_status in UserOrderStats.STATUS_COUNTERS:
+            deltas[UserOrderStats.STATUS_COUNTERS[new_status]] += 1
+        if old_status == PAID:
+            deltas['lifetime_spend'] -= total_price
+        if new_status == PAID:
+            deltas['lifetime_spend'] += total_price
+
+    for user_id, deltas in per_user.items():
+        _apply(user_id, deltas)
+
+
+def _stats_rows(orders):
+    """One dict of UserOrderStats field values per user in `orders`."""
+    return orders.values('user_id').order_by('user_id').annotate(
+        order_count=Count('id'),
+        lifetime_spend=Coalesce(Sum('total_price', filter=Q(status=PAID)), Value(Decimal('0.00')), output_field=MONEY),
+        last_order_date=Max('order_date'),
+        **{
+            counter: Count('id', filter=Q(status=status))
+            for status, counter in UserOrderStats.STATUS_COUNTERS.items()
+        },
+    )
+
+
+def rebuild_order_stats(user_ids=None, batch_size=1000):
+    """
+    Recompute stats from Order for `user_ids` (all users when None) with one
+    grouped aggregate and batched upserts. Returns the number of rows written.
+    """
+    orders = Order.objects.filter(user__isnull=False)
+    stats = UserOrderStats.objects.all()
+    if user_ids is not None:
+        orders = orders.filter(user_id__in=user_ids)
+        stats = stats.filter(pk__in=user_ids)
+
+    fields = ['order_count', 'lifetime_spend', 'last_order_date', *UserOrderStats.STATUS_COUNTERS.values(), 'updated_at']
+    written, batch = 0, []
+    for row in _stats_rows(orders).iterator(chunk_size=batch_size):
+        batch.append(UserOrderStats(**row))
+        if len(batch) == batch_size:
+            written += _upsert(batch, fields)
+            batch = []
+    written += _upsert(batch, fields)
+
+    # Users whose orders are all gone keep no stats row
+    stats.filter(~Exists(Order.objects.filter(user_id=OuterRef('pk')))).delete()
+    return written
+
+
+def _upsert(batch, fields):
+    if batch:
+        UserOrderStats.objects.bulk_create(batch, update_conflicts=True, unique_fields=['user'], update_fields=fields)
+    return len(batch)
@@ -0,0 +1,203 @@
+"""
+Stock reservations on sharded inventory counters.
+
+A stock-tracked product's units are spread over STOCK['SHARDS'] StockShard
+rows. Reserving takes units with conditional UPDATEs
+(`available = available - n WHERE available >= n`) on a random shard that
+can cover the quantity, so buyers of one hot product mostly write different
+rows and never hold a lock across a read. Units are never taken twice: a
+decrement that loses a race simply matches no row and the next shard is
+tried. Rows stay locked until commit, so they are always taken in one order
+(product id, then ascending shard id when one shard is not enough) and two
+checkouts cannot deadlock.
+
+place_order() reserves the cart inside its transaction (an OutOfStock rolls
+the whole order back). change_order_status() commits the reservations of
+orders that become "Paid" and releases those of orders that become
+"Payment Failed"; the release_expired_reservations command fails unpaid
+orders whose reservations outlived STOCK['RESERVATION_TTL'].
+"""
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import StockReservation, StockShard
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SHARDS': 8,
+    'RESERVATION_TTL': 15 * 60,  # seconds an unpaid order keeps its units
+    'MAX_ATTEMPTS': 3,           # passes over a product's shards before giving up
+}
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'STOCK', {})}
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, wanted, available):
+        self.product_id = product_id
+        self.wanted = wanted
+        self.available = available
+        super().__init__(f"Only {available} of product {product_id} left, {wanted} wanted")
+
+
+def set_stock(product, quantity, shards=None):
+    """Make `quantity` units of `product` available, spread evenly over its shards."""
+    shards = shards or get_options()['SHARDS']
+    share, extra = divmod(quantity, shards)
+    with transaction.atomic():
+        StockShard.objects.filter(product=product).delete()
+        StockShard.objects.bulk_create([
+            StockShard(product=product, shard=index, available=share + (1 if index < extra else 0))
+            for index in range(shards)
+        ])
+
+
+def stock_levels(product_ids):
+    """{product id: available units} for the stock-tracked products among `product_ids`."""
+    rows = StockShard.objects.filter(product_id__in=product_ids).values('product_id').annotate(total=Sum('available'))
+    return {row['product_id']: row['total'] for row in rows.order_by()}
+
+
+def _take(wanted, shards, after=-1):
+    """
+    Take `wanted` units from `shards` [(id, available)] sorted by id; returns
+    (units taken, id of the last shard taken from).
+
+    Each successful decrement keeps its row locked until commit, so rows are
+    taken in a fixed order and two buyers can never wait on each other:
+    - usually one shard covers the whole quantity; it is picked at random so
+      buyers spread over the shards, and only that one row gets locked;
+    - otherwise units are taken shard by shard in ascending id, never below a
+      shard this transaction already holds (`after`).
+    A decrement that does not match (lost race) takes no lock.
+    """
+    shards = [(shard_id, available) for shard_id, available in shards if shard_id > after]
+    if after < 0:
+        whole = [shard_id for shard_id, available in shards if available >= wanted]
+        random.shuffle(whole)
+        for shard_id in whole:
+            if StockShard.objects.filter(id=shard_id, available__gte=wanted).update(available=F('available') - wanted):
+                return wanted, shard_id
+
+    taken = 0
+    for shard_id, available in shards:
+        amount = min(wanted - taken, available)
+        if amount <= 0:
+            continue
+        if StockShard.objects.filter(id=shard_id, available__gte=amount).update(available=F('available') - amount):
+            taken += amount
+            after = shard_id
+            if taken == wanted:
+                break
+    return taken, after
+
+
+def reserve(order, lines):
+    """
+    Reserve `lines` [(product id, quantity)] for `order`. Call inside the
+    order's transaction: on OutOfStock the caller's rollback returns any
+    units already taken. Untracked products are skipped. Products are taken
+    in id order, so multi-product carts lock shards in the same order too.
+    """
+    wanted = defaultdict(int)
+    for product_id, quantity in lines:
+        wanted[product_id] += quantity
+
+    shards = defaultdict(list)
+    for shard_id, product_id, available in StockShard.objects.filter(product_id__in=wanted).order_by('id').values_list(
+        'id', 'product_id', 'available'
+    ):
+        shards[product_id].append((shard_id, available))
+    if not shards:
+        return []
+
+    options = get_options()
+    for product_id in sorted(shards):
+        product_shards, needed, after = shards[product_id], wanted[product_id], -1
+        for _ in range(options['MAX_ATTEMPTS']):
+            taken, after = _take(needed, product_shards, after)
+            needed -= taken
+            if not needed:
+                break
+            # Lost races to other buyers: look at the shards again
+            product_shards = list(
+                StockShard.objects.filter(product_id=product_id).order_by('id').values_list('id', 'available')
+            )
+            if sum(available for shard_id, available in product_shards if shard_id > after) < needed:
+                break
+        if needed:
+            raise OutOfStock(product_id, wanted[product_id], wanted[product_id] - needed)
+
+    expires_at = timezone.now() + timedelta(seconds=options['RESERVATION_TTL'])
+    return StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=wanted[product_id], expires_at=expires_at)
+        for product_id in sorted(shards)
+    ])
+
+
+def _give_back(product_id, quantity):
+    # Any shard will do; spreading returns keeps the shards balanced
+    shard = random.randrange(get_options()['SHARDS'])
+    if not StockShard.objects.filter(product_id=product_id, shard=shard).update(available=F('available') + quantity):
+        StockShard.objects.filter(product_id=product_id, shard=0).update(available=F('available') + quantity)
+
+
+def _per_product(reservations):
+    # Sorted by product id: returns lock one shard per product, in the order reserve() uses
+    totals = defaultdict(int)
+    for _, product_id, quantity in reservations:
+        totals[product_id] += quantity
+    return dict(sorted(totals.items()))
+
+
+def release(order_ids):
+    """Put the held units of these orders back into stock. Returns the reservations released."""
+    with transaction.atomic():
+        held = list(
+            StockReservation.objects.filter(order_id__in=order_ids, state=StockReservation.HELD)
+            .select_for_update().order_by('id').values_list('id', 'product_id', 'quantity')
+        )
+        if not held:
+            return 0
+        StockReservation.objects.filter(id__in=[row[0] for row in held]).update(state=StockReservation.RELEASED)
+        for product_id, quantity in _per_product(held).items():
+            _give_back(product_id, quantity)
+    return len(held)
+
+
+def commit(order_ids):
+    """
+    Keep the units of these (paid) orders for good. Reservations released
+    earlier (expired, or a failed attempt before this payment) are taken
+    again, even past zero.
+    """
+    with transaction.atomic():
+        reservations = StockReservation.objects.filter(order_id__in=order_ids).exclude(state=StockReservation.COMMITTED)
+        expired = list(
+            reservations.filter(state=StockReservation.RELEASED)
+            .select_for_update().order_by('id').values_list('id', 'product_id', 'quantity')
+        )
+        reservations.update(state=StockReservation.COMMITTED)
+        for product_id, quantity in _per_product(expired).items():
+            logger.warning("Paid after its stock was released: %s more of product %s sold", quantity, product_id)
+            _give_back(product_id, -quantity)
+
+
+def expired_order_ids(now=None, limit=500):
+    """Orders with held reservations past their expiry, oldest first."""
+    now = now or timezone.now()
+    order_ids = (
+        StockReservation.objects.filter(state=StockReservation.HELD, expires_at__lte=now)
+        .order_by('expires_at').values_list('order_id', flat=True)[:limit]
+    )
+    return list(dict.fromkeys(order_ids))
@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    Stores each upload under the SHA-256 of its content, e.g.
+    products/3f1c9a0e6b2d47aa.jpeg. Uploading the same picture again reuses
+    the existing file instead of writing dress1_Nuewio6.jpeg, dress1_TdFiBJW.jpeg, ...
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = os.path.join(directory, digest.hexdigest()[:32] + extension).replace('\\', '/')
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+product_image_storage = ContentHashStorage()
+
+
+def get_product_image_storage():
+    return product_image_storage
+
+
+# Text formats worth compressing; images and fonts like woff2 are compressed already
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico'}
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic storage that fingerprints every file (styles.css ->
+    styles.55e7cbb9ba48.css, via the manifest) and then writes a .gz and,
+    when the brotli package is installed, a .br copy of each compressible
+    hashed file next to it. checkapp.views.static_asset serves those copies
+    to clients that accept them, so nothing is compressed per request.
+    """
+
+    # Variants are only kept when they save at least this fraction of the bytes
+    MIN_SAVING = 0.05
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        brotli = _brotli()
+        for name in set(self.hashed_files.values()):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(name) as handle:
+                data = handle.read()
+            self._write_variant(name + '.gz', data, gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._write_variant(name + '.br', data, brotli.compress(data))
+
+    def _write_variant(self, name, original, compressed):
+        if len(compressed) > len(original) * (1 - self.MIN_SAVING):
+            return
+        with open(self.path(name), 'wb') as handle:
+            handle.write(compressed)
@@ -0,0 +1,29 @@
+from django import template
+
+from ..images import DERIVATIVE_WIDTHS, derivative_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(image, width, fmt='webp'):
+    return derivative_url(image, int(width), fmt)
+
+
+@register.simple_tag
+def image_srcset(image, fmt='webp', max_width=None):
+    widths = [w for w in DERIVATIVE_WIDTHS if max_width is None or w <= int(max_width)] or DERIVATIVE_WIDTHS[:1]
+    return ', '.join(f"{derivative_url(image, width, fmt)} {width}w" for width in widths)
+
+
+@register.inclusion_tag('includes/responsive_image.html')
+def responsive_image(image, alt='', sizes='100vw', css_class='', max_width=None):
+    """<picture> with WebP and JPEG srcsets; pass max_width to skip variants bigger than the slot."""
+    return {
+        'webp_srcset': image_srcset(image, 'webp', max_width),
+        'jpeg_srcset': image_srcset(image, 'jpeg', max_width),
+        'fallback': thumbnail_url(image, DERIVATIVE_WIDTHS[0], 'jpeg'),
+        'alt': alt,
+        'sizes': sizes,
+        'css_class': css_class,
+    }
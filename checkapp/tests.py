@@ -1,3 +1,1345 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import BytesIO, StringIO
+import asyncio
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import metrics
+from .auth import user_cache_key
+from .checks import check_shared_cache
+from .benchmarks import (
+    FUNNEL_STEPS, run_flash_sale, run_funnel, run_session_overhead, seed_products, seed_shoppers, seed_users,
+)
+from .feeds import ProductImporter, read_rows
+from .images import derivative_name, derivative_storage
+from .management.commands.benchmark_db import compare as compare_db_runs
+from .cart import DatabaseCart, save_cart
+from .gateway import FakeGateway, PaymentGatewayError, RazorpayGateway, get_gateway
+from .models import (
+    BillingDetails, CartItem, Order, OrderItem, OrderReceipt, PaymentEvent, Product, StockReservation, StockShard,
+    UserOrderStats,
+)
+from .pagination import encode_cursor
+from .search import rebuild_index, search_products
+from .views import confirmation_url
+from .services import (
+    aensure_gateway_order, change_order_status, ensure_gateway_order, place_order, process_payment_events,
+    record_payment_event, release_expired_reservations,
+)
+from .stock import OutOfStock, set_stock, stock_levels
+
+
+def make_products(count, price='10.00'):
+    return Product.objects.bulk_create([
+        Product(name=f'Dress {i}', price=Decimal(price), description='', image='products/missing.jpeg')
+        for i in range(count)
+    ])
+
+
+def fill_cart(user, products, quantity=2):
+    CartItem.objects.bulk_create([
+        CartItem(user=user, cartproduct=product, quantity=quantity) for product in products
+    ])
+
+
+def billing():
+    return BillingDetails(phone_number='9999999999', Full_name='Test User', Address='Somewhere')
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@example.com', password='pw')
+
+    def test_creates_order_items_and_clears_cart(self):
+        fill_cart(self.user, make_products(3, price='12.50'), quantity=2)
+
+        order = place_order(self.user, billing())
+
+        self.assertEqual(order.total_quantity, 6)
+        self.assertEqual(order.total_price, Decimal('75.00'))
+        self.assertEqual(order.billing_details.user, self.user)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_empty_cart_saves_nothing(self):
+        self.assertIsNone(place_order(self.user, billing()))
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(BillingDetails.objects.exists())
+
+    def test_query_count_does_not_grow_with_cart(self):
+        # A user's first order also creates their stats row; measure returning customers
+        UserOrderStats.objects.create(user=self.user)
+        counts = []
+        for size in (1, 50):
+            fill_cart(self.user, make_products(size))
+            with CaptureQueriesContext(connection) as ctx:
+                place_order(self.user, billing())
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('history@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.products = make_products(3)
+
+    def place_orders(self, count):
+        for _ in range(count):
+            fill_cart(self.user, self.products)
+            place_order(self.user, billing())
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.client.get('/order_history/')  # the first request also caches the logged-in user
+        counts = []
+        for count in (1, 15):
+            self.place_orders(count)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/order_history/')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(ctx))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cursor_pages_cover_every_order_once(self):
+        self.place_orders(45)
+        seen = []
+        url = '/order_history/'
+        while url:
+            response = self.client.get(url)
+            seen.extend(order.id for order in response.context['orders'])
+            cursor = response.context['next_cursor']
+            url = f'/order_history/?cursor={cursor}' if cursor else None
+        expected = list(Order.objects.filter(user=self.user).order_by('-order_date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_summary_uses_first_item_and_count(self):
+        self.place_orders(1)
+        order = self.client.get('/order_history/').context['orders'][0]
+        self.assertEqual(order.summary.item_count, 3)
+        self.assertEqual(order.summary.first_line.product_id, self.products[0].pk)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        self.place_orders(1)
+        response = self.client.get('/order_history/?cursor=not-a-cursor')
+        self.assertEqual(len(response.context['orders']), 1)
+
+
+
+class OrderReceiptTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('receipt@example.com', password='pw')
+        self.products = make_products(2, price='12.50')
+        fill_cart(self.user, self.products, quantity=3)
+        self.order = place_order(self.user, billing())
+
+    def test_snapshot_is_written_at_placement(self):
+        data = OrderReceipt.objects.get(order=self.order).data
+        self.assertEqual(data['billing'], {'name': 'Test User', 'phone': '9999999999', 'address': 'Somewhere'})
+        self.assertEqual([line['name'] for line in data['lines']], ['Dress 0', 'Dress 1'])
+        self.assertEqual(data['lines'][0]['total'], '37.50')
+        self.assertEqual(data['total_price'], '75.00')
+
+    def test_pages_keep_showing_what_was_bought(self):
+        Product.objects.filter(pk=self.products[0].pk).update(name='Renamed', price=Decimal('99.00'))
+        self.client.force_login(self.user)
+        response = self.client.get('/order_history/')
+        self.assertContains(response, 'Dress 0')
+        self.assertNotContains(response, 'Renamed')
+
+    def test_receipts_are_immutable(self):
+        receipt = OrderReceipt.objects.get(order=self.order)
+        with self.assertRaises(ValueError):
+            receipt.save()
+
+
+FAKE_GATEWAY = {'BACKEND': 'checkapp.gateway.FakeGateway', 'WEBHOOK_SECRET': 'whsec'}
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class GatewayTests(TestCase):
+    def test_gateway_is_shared_per_process(self):
+        self.assertIsInstance(get_gateway(), FakeGateway)
+        self.assertIs(get_gateway(), get_gateway())
+
+    def test_signature_round_trip(self):
+        gateway = get_gateway()
+        signature = gateway.sign('order_1', 'pay_1')
+        self.assertTrue(gateway.verify_payment_signature('order_1', 'pay_1', signature))
+        self.assertFalse(gateway.verify_payment_signature('order_1', 'pay_2', signature))
+
+    def test_idempotent_calls_are_retried(self):
+        gateway = RazorpayGateway('key', 'secret', {
+            'CONNECT_TIMEOUT': 1, 'READ_TIMEOUT': 1, 'MAX_RETRIES': 2, 'RETRY_BACKOFF': 0, 'POOL_MAXSIZE': 1,
+        })
+        fetch = mock.Mock(side_effect=[requests.ConnectionError(), {'id': 'order_1'}])
+        with mock.patch.object(gateway.client.order, 'fetch', fetch):
+            self.assertEqual(gateway.fetch_order('order_1'), {'id': 'order_1'})
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(fetch.call_args.kwargs['timeout'], (1, 1))
+
+        create = mock.Mock(side_effect=requests.ConnectionError())
+        with mock.patch.object(gateway.client.order, 'create', create):
+            with self.assertRaises(PaymentGatewayError):
+                gateway.create_order(100)
+        self.assertEqual(create.call_count, 1)
+
+    async def test_async_calls_use_the_same_retry_rules(self):
+        gateway = RazorpayGateway('key', 'secret', {
+            'CONNECT_TIMEOUT': 1, 'READ_TIMEOUT': 1, 'MAX_RETRIES': 2, 'RETRY_BACKOFF': 0, 'POOL_MAXSIZE': 1,
+        })
+        requests_seen = []
+
+        def handler(request):
+            requests_seen.append(request)
+            if len(requests_seen) == 1:
+                return httpx.Response(502)
+            return httpx.Response(200, json={'id': 'order_1', 'amount': 100})
+
+        client = httpx.AsyncClient(base_url=gateway.client.base_url, transport=httpx.MockTransport(handler))
+        with mock.patch('checkapp.gateway._long_lived_loop', True), \
+                mock.patch.object(gateway, '_async_client', return_value=client):
+            self.assertEqual((await gateway.afetch_order('order_1'))['id'], 'order_1')
+            self.assertEqual(len(requests_seen), 2)
+
+            requests_seen.clear()
+            with self.assertRaises(PaymentGatewayError):
+                await gateway.acreate_order(100)
+            self.assertEqual(len(requests_seen), 1)
+            self.assertEqual(requests_seen[0].url.path, '/v1/orders')
+
+    async def test_async_calls_without_long_lived_loop_use_pooled_session(self):
+        gateway = RazorpayGateway('key', 'secret', {
+            'CONNECT_TIMEOUT': 1, 'READ_TIMEOUT': 1, 'MAX_RETRIES': 0, 'RETRY_BACKOFF': 0, 'POOL_MAXSIZE': 1,
+        })
+        with mock.patch.object(gateway.client.order, 'fetch', return_value={'id': 'order_1'}) as fetch, \
+                mock.patch.object(gateway, '_async_client') as async_client:
+            self.assertEqual((await gateway.afetch_order('order_1'))['id'], 'order_1')
+        self.assertEqual(fetch.call_count, 1)
+        async_client.assert_not_called()
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class GatewayOrderCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cache@example.com', password='pw')
+        fill_cart(self.user, make_products(2))
+        self.order = place_order(self.user, billing())
+        self.client.force_login(self.user)
+        self.gateway_orders_before = len(get_gateway().orders)
+
+    def test_repeat_renders_reuse_gateway_order(self):
+        first = self.client.get(confirmation_url(self.order)).context['razorpay_order_id']
+        second = self.client.get(confirmation_url(self.order)).context['razorpay_order_id']
+        self.assertEqual(first, second)
+        self.assertEqual(len(get_gateway().orders) - self.gateway_orders_before, 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.razorpay_amount, 4000)
+
+    def test_gateway_call_is_made_outside_a_transaction(self):
+        gateway = get_gateway()
+        create_order = gateway.create_order
+        in_transaction = []
+
+        def recording_create_order(*args, **kwargs):
+            in_transaction.append(connection.in_atomic_block)
+            return create_order(*args, **kwargs)
+
+        with mock.patch.object(gateway, 'create_order', recording_create_order):
+            ensure_gateway_order(self.order)
+        self.assertEqual(in_transaction, [False])
+        self.assertTrue(Order.objects.get(pk=self.order.pk).razorpay_order_id)
+
+    def test_concurrent_first_renders_make_one_gateway_call(self):
+        ids, errors = [], []
+        start = threading.Barrier(8)
+
+        def render(order):
+            try:
+                start.wait()
+                ids.append(ensure_gateway_order(order).razorpay_order_id)
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        # Each "request" has its own stale copy of the order, loaded before the race
+        orders = [Order.objects.get(pk=self.order.pk) for _ in range(8)]
+        threads = [threading.Thread(target=render, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(ids)), 1)
+        self.assertEqual(len(get_gateway().orders) - self.gateway_orders_before, 1)
+
+    @mock.patch('checkapp.gateway._long_lived_loop', True)
+    async def test_concurrent_async_renders_make_one_gateway_call(self):
+        orders = [await Order.objects.aget(pk=self.order.pk) for _ in range(8)]
+        results = await asyncio.gather(*(aensure_gateway_order(order) for order in orders))
+
+        self.assertEqual(len({order.razorpay_order_id for order in results}), 1)
+        self.assertEqual(len(get_gateway().orders) - self.gateway_orders_before, 1)
+
+    def test_concurrent_async_renders_under_wsgi_make_one_gateway_call(self):
+        # Under WSGI each async view runs on its own event loop via async_to_sync
+        ids, errors = [], []
+        start = threading.Barrier(5)
+        gateway = get_gateway()
+        create_order = gateway.create_order
+
+        def slow_create_order(*args, **kwargs):
+            time.sleep(0.05)  # a remote call, long enough for the threads to overlap
+            return create_order(*args, **kwargs)
+
+        def render(order):
+            try:
+                start.wait()
+                ids.append(async_to_sync(aensure_gateway_order)(order).razorpay_order_id)
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        orders = [Order.objects.get(pk=self.order.pk) for _ in range(5)]
+        threads = [threading.Thread(target=render, args=(order,)) for order in orders]
+        with mock.patch.object(gateway, 'create_order', slow_create_order):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(ids)), 1)
+        self.assertEqual(len(gateway.orders) - self.gateway_orders_before, 1)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class PaymentEventTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('payer@example.com', password='pw')
+        fill_cart(user, make_products(1))
+        self.order = ensure_gateway_order(place_order(user, billing()))
+        self.gateway_order_id = self.order.razorpay_order_id
+
+    def callback(self, payment_id, signature=None):
+        return self.client.post(f'/payment-success/?order_id={self.order.id}', {
+            'razorpay_order_id': self.gateway_order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': signature or get_gateway().sign(self.gateway_order_id, payment_id),
+        })
+
+    def webhook(self, event, payment_id):
+        body = json.dumps({
+            'event': event,
+            'payload': {'payment': {'entity': {'id': payment_id, 'order_id': self.gateway_order_id}}},
+        }).encode()
+        return self.client.post(
+            '/razorpay/webhook/', body, content_type='application/json',
+            headers={'X-Razorpay-Signature': get_gateway().sign_webhook(body)},
+        )
+
+    def order_status(self):
+        self.order.refresh_from_db()
+        return self.order.status
+
+    def test_callback_is_queued_and_applied_by_worker(self):
+        self.assertEqual(self.callback('pay_1').status_code, 200)
+        self.assertEqual(self.order_status(), 'Pending')
+
+        call_command('process_payment_events', stdout=StringIO())
+        self.assertEqual(self.order_status(), 'Paid')
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_replayed_events_are_stored_once(self):
+        self.callback('pay_1')
+        self.callback('pay_1')
+        self.webhook('payment.captured', 'pay_1')
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+    def test_bad_signatures_are_not_queued(self):
+        self.callback('pay_1', signature='forged')
+        body = b'{"event": "payment.captured"}'
+        response = self.client.post(
+            '/razorpay/webhook/', body, content_type='application/json',
+            headers={'X-Razorpay-Signature': 'forged'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_paid_is_never_downgraded(self):
+        self.webhook('payment.failed', 'pay_1')
+        self.webhook('payment.captured', 'pay_2')
+        call_command('process_payment_events', stdout=StringIO())
+        self.assertEqual(self.order_status(), 'Paid')
+
+        self.webhook('payment.failed', 'pay_3')
+        call_command('process_payment_events', stdout=StringIO())
+        self.assertEqual(self.order_status(), 'Paid')
+
+
+class CatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_come_from_the_database(self):
+        products = make_products(30)
+        first = self.client.get('/')
+        self.assertContains(first, products[0].name)
+        self.assertEqual(len(first.context['All_data']), 24)
+
+        second = self.client.get(f"/?cursor={first.context['next_cursor']}")
+        self.assertEqual([p.id for p in second.context['All_data']], [p.id for p in products[24:]])
+        self.assertIsNone(second.context['next_cursor'])
+
+    def test_cached_page_skips_database(self):
+        make_products(3)
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+    def test_junk_cursors_share_the_first_page_entry(self):
+        make_products(3)
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            for cursor in ('junk', 'x' * 500, 'WyJhIl0', 'WzEsIDJd'):  # not base64 JSON, ["a"], [1, 2]
+                response = self.client.get('/', {'cursor': cursor})
+                self.assertTrue(response.context['is_first_page'])
+                self.assertEqual(len(response.context['All_data']), 3)
+
+    def test_product_change_invalidates_cache(self):
+        product = make_products(1)[0]
+        self.client.get('/')
+        product.name = 'Renamed dress'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertContains(self.client.get('/'), 'Renamed dress')
+
+
+class ProductPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_products(1)[0]
+        self.url = f'/product/{self.product.id}/'
+
+    def test_repeat_hits_are_served_from_cache(self):
+        self.assertContains(self.client.get(self.url), self.product.name)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url), self.product.name)
+
+    def test_conditional_get_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        again = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def test_product_change_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.product.price = Decimal('99.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_product_is_404(self):
+        self.assertEqual(self.client.get('/product/999999/').status_code, 404)
+
+
+def jpeg_upload(color='red', size=(800, 600)):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile('dress.jpeg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ProductImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def make_product(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name='Dress', price=Decimal('10.00'), description='', image=upload)
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.make_product(jpeg_upload())
+        second = self.make_product(jpeg_upload())
+        other = self.make_product(jpeg_upload(color='blue'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 2)
+
+    def test_variants_are_built_at_upload(self):
+        product = self.make_product(jpeg_upload())
+        from PIL import Image
+
+        with derivative_storage.open(derivative_name(product.image.name, 320, 'webp')) as variant:
+            image = Image.open(variant)
+            self.assertEqual((image.format, image.width), ('WEBP', 320))
+
+    def test_responsive_image_tag(self):
+        product = self.make_product(jpeg_upload())
+        html = Template(
+            '{% load product_images %}{% responsive_image image alt="Dress" sizes="56px" max_width=160 %}'
+        ).render(Context({'image': product.image}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('_160w.webp 160w', html)
+        self.assertNotIn('320w', html)
+
+
+class CartStorageTests(TestCase):
+    def setUp(self):
+        self.products = make_products(2)
+        self.user = User.objects.create_user('cart@example.com', password='pw')
+
+    def test_anonymous_cart_makes_no_cartitem_writes(self):
+        product = self.products[0]
+        self.client.get(f'/add_to_cart/{product.id}/')
+        self.client.get(f'/add_to_cart/{product.id}/')
+        self.client.post(f'/cart_update/{self.products[1].id}/', {'quantity': 3})
+
+        self.assertFalse(CartItem.objects.exists())
+        lines = self.client.get('/cart/').context['cart_items']
+        self.assertEqual([(line.cartproduct.id, line.quantity) for line in lines], [(product.id, 2)])
+
+    def test_login_merges_session_cart_with_saved_cart(self):
+        CartItem.objects.create(user=self.user, cartproduct=self.products[0], quantity=1)
+        self.client.get(f'/add_to_cart/{self.products[0].id}/')
+        self.client.get(f'/add_to_cart/{self.products[1].id}/')
+
+        self.client.post('/login/', {'username': 'cart@example.com', 'password': 'pw'})
+
+        lines = self.client.get('/cart/').context['cart_items']
+        self.assertEqual(
+            sorted((line.cartproduct.id, line.quantity) for line in lines),
+            [(self.products[0].id, 2), (self.products[1].id, 1)],
+        )
+
+    def test_every_login_path_merges_session_cart(self):
+        staff = User.objects.create_user('staff@example.com', password='pw', is_staff=True)
+        CartItem.objects.create(user=staff, cartproduct=self.products[0], quantity=1)
+        self.client.get(f'/add_to_cart/{self.products[1].id}/')
+
+        self.client.post('/admin/login/', {'username': 'staff@example.com', 'password': 'pw'})
+
+        lines = self.client.get('/cart/').context['cart_items']
+        self.assertEqual(
+            sorted((line.cartproduct.id, line.quantity) for line in lines),
+            [(self.products[0].id, 1), (self.products[1].id, 1)],
+        )
+
+    def test_logging_in_again_does_not_merge_twice(self):
+        staff = User.objects.create_user('staff@example.com', password='pw', is_staff=True)
+        CartItem.objects.create(user=staff, cartproduct=self.products[0], quantity=2)
+
+        self.client.post('/login/', {'username': 'staff@example.com', 'password': 'pw'})
+        self.client.post('/admin/login/', {'username': 'staff@example.com', 'password': 'pw'})
+        self.client.get('/logout/')  # flushes the session cart into CartItem
+
+        self.assertEqual(CartItem.objects.get(user=staff).quantity, 2)
+
+    def test_checkout_flushes_session_cart_into_order(self):
+        self.client.force_login(self.user)
+        self.client.get(f'/add_to_cart/{self.products[0].id}/')
+        self.client.get(f'/add_to_cart/{self.products[0].id}/')
+
+        response = self.client.post('/checkout/', {
+            'phone_number': '9999999999', 'Full_name': 'Test User', 'Address': 'Somewhere',
+        })
+
+        item = OrderItem.objects.get(order__user=self.user)
+        self.assertRedirects(response, confirmation_url(item.order), fetch_redirect_response=False)
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(self.client.get('/cart/').context['cart_items'], [])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_logout_keeps_cart_in_database(self):
+        self.client.force_login(self.user)
+        self.client.get(f'/add_to_cart/{self.products[1].id}/')
+        self.client.get('/logout/')
+        self.assertEqual(CartItem.objects.get(user=self.user).cartproduct, self.products[1])
+
+    @override_settings(CART_BACKEND='database')
+    def test_database_backend_writes_cartitem(self):
+        self.client.force_login(self.user)
+        self.client.get(f'/add_to_cart/{self.products[0].id}/')
+        self.client.get(f'/add_to_cart/{self.products[0].id}/')
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 2)
+        self.client.get(f'/remove_cart/{self.products[0].id}/')
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('race@example.com', password='pw')
+        self.product = make_products(1)[0]
+
+    def test_parallel_adds_never_lose_increments_or_duplicate_lines(self):
+        threads_count, adds_per_thread = 8, 25
+        errors = []
+        start = threading.Barrier(threads_count)
+
+        def click():
+            try:
+                start.wait()
+                cart = DatabaseCart(self.user)
+                for _ in range(adds_per_thread):
+                    cart.add(self.product.id)
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=click) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        line = CartItem.objects.get(user=self.user, cartproduct=self.product)
+        self.assertEqual(line.quantity, threads_count * adds_per_thread)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_double_submit_places_one_order(self):
+        # SQLite serializes writers itself; this covers row-locking backends under READ COMMITTED
+        fill_cart(self.user, [self.product])
+        orders, errors = [], []
+        start = threading.Barrier(2)
+
+        def submit():
+            try:
+                start.wait()
+                orders.append(place_order(self.user, billing()))
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=submit) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(order is not None for order in orders), 1)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_save_cart_upserts_existing_lines(self):
+        CartItem.objects.create(user=self.user, cartproduct=self.product, quantity=1)
+        save_cart(self.user, {self.product.id: 5})
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 5)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('totals@example.com', password='pw')
+
+    def test_totals_in_one_query(self):
+        fill_cart(self.user, make_products(3, price='2.50'), quantity=4)
+        with self.assertNumQueries(1):
+            totals = CartItem.objects.filter(user=self.user).totals()
+        self.assertEqual(totals, {'total_amount': Decimal('30.00'), 'item_count': 12})
+
+    def test_empty_cart_totals(self):
+        self.assertEqual(
+            CartItem.objects.filter(user=self.user).totals(),
+            {'total_amount': Decimal('0.00'), 'item_count': 0},
+        )
+
+    def cart_page_queries(self, size):
+        CartItem.objects.filter(user=self.user).delete()
+        fill_cart(self.user, make_products(size))
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/cart/')
+        self.assertEqual(response.context['item_count'], size * 2)
+        return len(ctx)
+
+    @override_settings(CART_BACKEND='database')
+    def test_cart_page_query_count_is_constant(self):
+        self.assertEqual(self.cart_page_queries(1), self.cart_page_queries(20))
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_connections_are_tuned(self):
+        if connection.vendor != 'sqlite' or 'init_command' not in settings.DATABASES['default']['OPTIONS']:
+            self.skipTest("SQLite tuning profile not active")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_checkout_benchmark_compares_against_another_profile(self):
+        def run(vendor, throughput, p95):
+            return {'profile': {'vendor': vendor}, 'checkout': {
+                'throughput_per_s': throughput, 'p50_ms': 1.0, 'p95_ms': p95, 'p99_ms': p95, 'errors': 0,
+            }}
+
+        comparison = compare_db_runs(run('sqlite', 100.0, 40.0), run('postgresql', 250.0, 12.0))
+        self.assertEqual(comparison['profile'], [{'vendor': 'sqlite'}, {'vendor': 'postgresql'}])
+        self.assertEqual(comparison['p95_ms'], [40.0, 12.0])
+        self.assertEqual(comparison['throughput_ratio'], 2.5)
+
+
+class IndexPlanTests(TestCase):
+    """The hot lookups are answered from the composite indexes, without a sort step."""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plan assertions are written against SQLite's EXPLAIN QUERY PLAN")
+        self.user = User.objects.create_user('plan@example.com', password='pw')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'USING (COVERING )?INDEX ({index})\b')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_order_history(self):
+        self.assertUsesIndex(
+            Order.objects.filter(user=self.user).order_by('-order_date', '-id'), 'order_user_date_idx'
+        )
+
+    def test_orders_by_date(self):
+        self.assertUsesIndex(
+            Order.objects.filter(order_date__gte=timezone.now()).order_by('-order_date', '-id'), 'order_date_idx'
+        )
+
+    def test_orders_by_status(self):
+        self.assertUsesIndex(Order.objects.filter(status='Paid').order_by('-order_date'), 'order_status_date_idx')
+
+    def test_cart_lines(self):
+        # SQLite keeps the unique constraint inline, so its index gets an automatic name
+        unique_index = r'unique_cart_line|sqlite_autoindex_checkapp_cartitem_\d+'
+        self.assertUsesIndex(CartItem.objects.filter(user=self.user), unique_index)
+        self.assertUsesIndex(CartItem.objects.filter(user=self.user, cartproduct_id=1), unique_index)
+
+    def test_order_items(self):
+        self.assertUsesIndex(OrderItem.objects.filter(order_id=1).order_by('id'), 'orderitem_order_id_idx')
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY, PERF_METRICS={'TOKEN': 'scrape'})
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+        make_products(3)
+
+    def server_timing(self, response):
+        return dict(
+            (part.split(';')[0], part) for part in response['Server-Timing'].split(', ')
+        )
+
+    def test_server_timing_header(self):
+        timing = self.server_timing(self.client.get('/'))
+        self.assertIn('db', timing)
+        self.assertIn('template', timing)
+        self.assertIn('total', timing)
+        self.assertNotIn('gateway', timing)
+
+    def test_gateway_calls_are_counted(self):
+        user = User.objects.create_user('timing@example.com', password='pw')
+        fill_cart(user, Product.objects.all())
+        url = confirmation_url(place_order(user, billing()))
+        self.client.force_login(user)
+
+        self.assertIn('desc="1"', self.server_timing(self.client.get(url))['gateway'])
+        self.assertNotIn('gateway', self.server_timing(self.client.get(url)))
+
+    def test_histograms_per_url_name(self):
+        for _ in range(5):
+            self.client.get('/')
+        self.client.get('/cart/')
+
+        summary = metrics.summarize(metrics.metrics_snapshot())
+        self.assertEqual(summary['product_list']['count'], 5)
+        self.assertEqual(summary['cart_view']['count'], 1)
+        self.assertLessEqual(summary['product_list']['p50_ms'], summary['product_list']['p99_ms'])
+
+        out = StringIO()
+        call_command('dump_request_metrics', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['product_list']['count'], 5)
+
+    def test_metrics_endpoint_needs_token_or_staff(self):
+        self.client.get('/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get('/metrics/', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('product_list', response.json())
+
+    def test_bucket_percentiles(self):
+        buckets = {}
+        for ms in [1] * 90 + [100] * 10:
+            index = str(metrics.bucket_index(ms))
+            buckets[index] = buckets.get(index, 0) + 1
+        self.assertEqual(metrics.bucket_percentile(buckets, 100, 0.5), 1)
+        self.assertAlmostEqual(metrics.bucket_percentile(buckets, 100, 0.99), 100, delta=20)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class CheckoutFunnelBenchmarkTests(TransactionTestCase):
+    def test_every_step_is_measured(self):
+        products = seed_products(4)
+        result = run_funnel(seed_users(3, prefix='funnel'), products, cart_size=2, threads=2)
+
+        self.assertEqual(result['error_samples'], [])
+        self.assertEqual(result['funnel']['requests'], 3)
+        self.assertEqual(result['steps']['add_to_cart']['requests'], 6)
+        for step in FUNNEL_STEPS:
+            self.assertIsNotNone(result['steps'][step]['p95_ms'], step)
+            self.assertIsNotNone(result['steps'][step]['queries_mean'], step)
+        self.assertEqual(PaymentEvent.objects.count(), 3)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('stock@example.com', password='pw')
+        self.dress, self.untracked = make_products(2)
+        set_stock(self.dress, 5, shards=4)
+
+    def buy(self, quantity):
+        CartItem.objects.filter(user=self.user).delete()
+        fill_cart(self.user, [self.dress, self.untracked], quantity=quantity)
+        return place_order(self.user, billing())
+
+    def available(self):
+        return stock_levels([self.dress.id, self.untracked.id])
+
+    def test_checkout_reserves_and_refuses_to_oversell(self):
+        order = self.buy(3)
+        self.assertEqual(self.available(), {self.dress.id: 2})  # the untracked product has no counters
+        self.assertEqual(list(order.stock_reservations.values_list('quantity', flat=True)), [3])
+
+        with self.assertRaises(OutOfStock):
+            self.buy(3)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.available(), {self.dress.id: 2})
+
+    def test_failed_payment_releases_and_paid_keeps(self):
+        failed, paid = self.buy(2), self.buy(2)
+        change_order_status(Order.objects.filter(pk=failed.pk), "Payment Failed")
+        change_order_status(Order.objects.filter(pk=paid.pk), "Paid")
+        self.assertEqual(self.available(), {self.dress.id: 3})
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('order_id', 'state')),
+            {failed.pk: StockReservation.RELEASED, paid.pk: StockReservation.COMMITTED},
+        )
+
+    def test_expired_reservations_fail_the_order(self):
+        order = self.buy(4)
+        self.assertEqual(release_expired_reservations(), 0)
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(release_expired_reservations(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Payment Failed")
+        self.assertEqual(self.available(), {self.dress.id: 5})
+
+    def test_shards_are_locked_in_product_then_shard_order(self):
+        other = make_products(1)[0]
+        set_stock(other, 4, shards=4)  # one unit per shard: two are needed
+        CartItem.objects.filter(user=self.user).delete()
+        fill_cart(self.user, [other], quantity=2)
+        fill_cart(self.user, [self.dress], quantity=3)  # 2 + 1 + 1 + 1 over four shards
+
+        with CaptureQueriesContext(connection) as ctx:
+            place_order(self.user, billing())
+        shards = dict(StockShard.objects.values_list('id', 'product_id'))
+        updated = [
+            int(re.search(r'"id" = (\d+)', q['sql']).group(1))
+            for q in ctx.captured_queries if q['sql'].startswith('UPDATE "checkapp_stockshard"')
+        ]
+        self.assertEqual(len(updated), 4)
+        self.assertEqual(updated, sorted(updated, key=lambda shard_id: (shards[shard_id], shard_id)))
+        self.assertEqual(stock_levels([self.dress.id, other.id]), {self.dress.id: 2, other.id: 2})
+
+    def test_checkout_page_reports_sold_out(self):
+        set_stock(self.dress, 1)
+        self.client.force_login(self.user)
+        self.client.get(f'/add_to_cart/{self.dress.id}/')
+        self.client.get(f'/add_to_cart/{self.dress.id}/')
+        response = self.client.post('/checkout/', {'phone_number': '9999999999', 'Full_name': 'A', 'Address': 'B'})
+        self.assertContains(response, 'Dress 0 is sold out (only 1 left)')
+        self.assertFalse(Order.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', "SQLite serializes writers; row-lock deadlocks need PostgreSQL")
+class StockDeadlockTests(TransactionTestCase):
+    def test_multi_shard_multi_product_checkouts_do_not_deadlock(self):
+        products = make_products(2)
+        for product in products:
+            set_stock(product, 400, shards=8)
+        buyers = [User.objects.create_user(f'lock{i}@example.com', password='pw') for i in range(8)]
+        errors = []
+        start = threading.Barrier(len(buyers))
+
+        def checkout(user, index):
+            try:
+                start.wait()
+                for _ in range(5):
+                    # Opposite cart orders and more units than one shard holds
+                    fill_cart(user, products[::1 if index % 2 else -1], quantity=60)
+                    place_order(user, billing())
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=checkout, args=(user, i)) for i, user in enumerate(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([exc for exc in errors if not isinstance(exc, OutOfStock)], [])
+
+
+class FlashSaleBenchmarkTests(TransactionTestCase):
+    def test_concurrent_buyers_never_oversell(self):
+        product = seed_products(1)[0]
+        result = run_flash_sale(seed_users(12, prefix='sale'), product, threads=4, stock=5, shards=3)
+
+        self.assertEqual(result['error_samples'], [])
+        self.assertEqual((result['sold'], result['sold_out'], result['remaining']), (5, 7, 0))
+        self.assertFalse(result['oversold'])
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', AUTH_USER_CACHE_TIMEOUT=300)
+class SessionUserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cached@example.com', password='pw', first_name='Ann')
+        self.client.force_login(self.user)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries if '"django_session"' in q['sql'] or '"auth_user"' in q['sql']]
+
+    def test_repeat_requests_skip_session_and_user_tables(self):
+        self.auth_queries('/cart/')
+        self.assertEqual(self.auth_queries('/cart/'), [])
+        self.assertEqual(self.auth_queries('/order_history/'), [])
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.client.get('/cart/')
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        self.user.first_name = 'Bea'
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get('/cart/').wsgi_request.user.first_name, 'Bea')
+
+    def test_password_change_ends_other_sessions(self):
+        self.client.get('/cart/')
+        self.user.set_password('new password')
+        self.user.save()
+        self.assertFalse(self.client.get('/cart/').wsgi_request.user.is_authenticated)
+
+    def test_cached_sessions_and_users_need_a_shared_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['checkapp.E001'])
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db', AUTH_USER_CACHE_TIMEOUT=0):
+            self.assertEqual(check_shared_cache(None), [])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class SessionBenchmarkTests(TransactionTestCase):
+    def test_cached_profile_saves_the_session_and_user_reads(self):
+        products = seed_products(2)
+        result = run_session_overhead(seed_shoppers(2, products, orders_per_user=1), products, repeats=2)
+
+        for page in ('cart_view', 'order_history'):
+            self.assertEqual(result['profiles']['db'][page]['session_user_queries_mean'], 2)
+            self.assertEqual(result['profiles']['cached_db'][page]['session_user_queries_mean'], 0)
+            self.assertEqual(result['saved_per_request']['cached_db'][page]['queries'], 2)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class UserOrderStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('stats@example.com', password='pw')
+        self.products = make_products(2)
+
+    def place(self):
+        fill_cart(self.user, self.products)
+        return ensure_gateway_order(place_order(self.user, billing()))
+
+    def stats(self):
+        return UserOrderStats.objects.get(pk=self.user.pk)
+
+    def test_kept_up_to_date_on_placement_and_status_change(self):
+        first, second = self.place(), self.place()
+        stats = self.stats()
+        self.assertEqual((stats.order_count, stats.pending_count, stats.paid_count), (2, 2, 0))
+        self.assertEqual(stats.last_order_date, second.order_date)
+        self.assertEqual(stats.lifetime_spend, 0)
+
+        record_payment_event('pay_1', first.razorpay_order_id, 'Paid', PaymentEvent.SOURCE_WEBHOOK)
+        record_payment_event('pay_2', second.razorpay_order_id, 'Payment Failed', PaymentEvent.SOURCE_WEBHOOK)
+        process_payment_events()
+        record_payment_event('pay_3', first.razorpay_order_id, 'Payment Failed', PaymentEvent.SOURCE_WEBHOOK)
+        process_payment_events()
+
+        stats = self.stats()
+        self.assertEqual((stats.pending_count, stats.paid_count, stats.failed_count), (0, 1, 1))
+        self.assertEqual(stats.lifetime_spend, first.total_price)
+
+    def test_rebuild_matches_incremental_totals(self):
+        order = self.place()
+        self.place()
+        change_order_status(Order.objects.filter(pk=order.pk), 'Paid')
+        expected = self.stats()
+
+        UserOrderStats.objects.all().delete()
+        call_command('rebuild_order_stats', stdout=StringIO())
+        rebuilt = self.stats()
+        for field in ['order_count', 'lifetime_spend', 'last_order_date', 'pending_count', 'paid_count']:
+            self.assertEqual(getattr(rebuilt, field), getattr(expected, field), field)
+
+        Order.objects.all().delete()
+        call_command('rebuild_order_stats', stdout=StringIO())
+        self.assertFalse(UserOrderStats.objects.exists())
+
+    def test_order_history_reads_stats_by_primary_key(self):
+        self.place()
+        self.client.force_login(self.user)
+        response = self.client.get('/order_history/')
+        self.assertEqual(response.context['stats'].order_count, 1)
+
+
+class ProductFeedTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.feed_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.feed_dir.cleanup)
+
+    def write_feed(self, name, text):
+        path = os.path.join(self.feed_dir.name, name)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        return path
+
+    def import_feed(self, path, *args):
+        out = StringIO()
+        call_command('import_products', path, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_import_upserts_by_sku_in_batches(self):
+        path = self.write_feed('feed.csv', (
+            'sku,name,price,description,image\n'
+            'A1,Red dress,10.50,Cotton,\n'
+            'B2,Blue dress,12,,\n'
+            'C3,Broken,not-a-price,,\n'
+            'A1,Red dress,11.00,Cotton,\n'
+        ))
+        self.assertIn('2 created, 1 updated, 0 unchanged, 1 rejected', self.import_feed(path, '--batch-size', '1'))
+        self.assertEqual(Product.objects.get(sku='A1').price, Decimal('11.00'))
+
+        path = self.write_feed('feed.jsonl', (
+            '{"sku": "A1", "name": "Red dress", "price": "11.00", "description": "Cotton"}\n'
+            '{"sku": "B2", "name": "Blue dress", "price": "9.99"}\n'
+        ))
+        self.assertIn('0 created, 1 updated, 1 unchanged', self.import_feed(path))
+        self.assertEqual(Product.objects.get(sku='B2').price, Decimal('9.99'))
+
+    def test_malformed_json_lines_are_rejected(self):
+        path = self.write_feed('feed.jsonl', (
+            '{"sku": "A1", "name": "Red dress", "price": "10.00"}\n'
+            '{"sku": "B2", "name": \n'
+            '[1, 2]\n'
+            '{"sku": "C3", "name": "Green dress", "price": "12.00"}\n'
+        ))
+        importer = ProductImporter()
+        with open(path) as stream:
+            report = importer.run(read_rows(stream, 'jsonl'))
+
+        self.assertEqual((report.rows, report.created, report.rejected), (4, 2, 2))
+        self.assertTrue(report.errors[0].startswith('row 2: invalid JSON'))
+        self.assertEqual(report.errors[1], 'row 3: expected a JSON object, got list')
+        self.assertEqual(set(Product.objects.values_list('sku', flat=True)), {'A1', 'C3'})
+
+    def test_images_are_stored_once_from_a_directory(self):
+        with open(os.path.join(self.feed_dir.name, 'dress.jpeg'), 'wb') as handle:
+            handle.write(jpeg_upload().read())
+        path = self.write_feed('feed.csv', (
+            'sku,name,price,description,image\n'
+            'A1,Red dress,10,,dress.jpeg\n'
+            'A2,Red dress XL,10,,dress.jpeg\n'
+        ))
+        self.import_feed(path, '--images', self.feed_dir.name)
+
+        first, second = Product.objects.order_by('sku')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.storage.exists(first.image.name))
+
+    def test_image_paths_cannot_leave_the_image_directory(self):
+        outside = tempfile.NamedTemporaryFile(suffix='.jpeg')
+        self.addCleanup(outside.close)
+        outside.write(jpeg_upload().read())
+        outside.flush()
+        escapes = [os.path.relpath(outside.name, self.feed_dir.name), outside.name, '../../checkout/settings.py']
+        rows = [{'sku': f'X{i}', 'name': 'Dress', 'price': '5', 'image': image} for i, image in enumerate(escapes)]
+
+        report = ProductImporter(image_dir=self.feed_dir.name).run(rows)
+        self.assertEqual((report.created, report.rejected), (0, 3))
+        self.assertIn('outside the image directory', report.errors[0])
+
+        stored_names = ['products/dress.jpeg', 'dress.jpeg', '../checkout/settings.py', 'products/../x.jpeg', '/etc/passwd']
+        rows = [{'sku': f'Y{i}', 'name': 'Dress', 'price': '5', 'image': image} for i, image in enumerate(stored_names)]
+        report = ProductImporter().run(rows)
+        self.assertEqual((report.created, report.rejected), (2, 3))
+        self.assertEqual(
+            sorted(Product.objects.values_list('image', flat=True)), ['dress.jpeg', 'products/dress.jpeg']
+        )
+
+    def test_export_round_trips_and_streams(self):
+        Product.objects.bulk_create([
+            Product(sku=f'S{i}', name=f'Dress {i}', price=Decimal('5.00'), description='a, "quoted" text')
+            for i in range(5)
+        ])
+        path = os.path.join(self.feed_dir.name, 'export.csv')
+        call_command('export_products', '--output', path, '--chunk-size', '2')
+        self.assertIn('0 created, 0 updated, 5 unchanged', self.import_feed(path))
+
+        staff = User.objects.create_user('staff@example.com', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/products/export/?format=jsonl')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['sku'], 'S0')
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        rebuild_index()
+
+    def make(self, name, description=''):
+        return Product.objects.create(name=name, price=Decimal('10.00'), description=description, image='products/missing.jpeg')
+
+    def names(self, query, **kwargs):
+        return [product.name for product in search_products(query, **kwargs).items]
+
+    def test_ranked_prefix_matches(self):
+        self.make('Plain shirt', 'Goes well with a summer dress')
+        self.make('Summer dress')
+        self.make('Winter coat')
+        self.assertEqual(self.names('dress'), ['Summer dress', 'Plain shirt'])
+        self.assertEqual(self.names('summer dre'), ['Summer dress', 'Plain shirt'])
+        self.assertEqual(self.names('"coat* OR'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        product = self.make('Red dress')
+        product.name = 'Green dress'
+        product.save()
+        self.assertEqual(self.names('green'), ['Green dress'])
+        self.assertEqual(self.names('red'), [])
+        product.delete()
+        self.assertEqual(self.names('green'), [])
+
+    def test_pages_do_not_overlap(self):
+        for i in range(5):
+            self.make(f'Dress {i}', 'dress ' * i)
+        seen, cursor = [], None
+        while True:
+            page = search_products('dress', cursor=cursor, page_size=2)
+            seen += [product.id for product in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_crafted_cursors_fall_back_to_the_first_page(self):
+        self.make('Summer dress')
+        for values in ([1.0, 10 ** 30], [10 ** 30, 1], [float('inf'), 1], [1.0, True], [1.0, 1.5], ['a', 1]):
+            response = self.client.get('/search/', {'q': 'summer', 'cursor': encode_cursor(values)})
+            self.assertContains(response, 'Summer dress', msg_prefix=repr(values))
+
+    def test_search_page(self):
+        self.make('Summer dress')
+        response = self.client.get('/search/', {'q': 'summ'})
+        self.assertContains(response, 'Summer dress')
+        self.assertEqual(response.context['query'], 'summ')
+        self.assertContains(self.client.get('/search/', {'q': 'nothing'}), 'No products match')
+
+    def test_bulk_imports_are_indexed(self):
+        ProductImporter().run([{'sku': 'X1', 'name': 'Linen dress', 'price': '5'}])
+        self.assertEqual(self.names('linen'), ['Linen dress'])
+
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', password='pw')
+        self.client.force_login(self.admin)
+        self.customer = User.objects.create_user('buyer@example.com', password='pw')
+        self.products = make_products(3)
+
+    def place_orders(self, count):
+        orders = []
+        for _ in range(count):
+            fill_cart(self.customer, self.products)
+            orders.append(place_order(self.customer, billing()))
+        return orders
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(ctx)
+
+    def test_changelists_do_not_query_per_row(self):
+        self.place_orders(2)
+        self.client.get('/admin/')  # the first request also caches the logged-in user
+        urls = ['/admin/checkapp/order/', '/admin/checkapp/orderitem/', '/admin/checkapp/billingdetails/']
+        few = [self.queries_for(url) for url in urls]
+        self.place_orders(10)
+        self.assertEqual([self.queries_for(url) for url in urls], few)
+        self.assertEqual(self.queries_for('/admin/checkapp/order/?status__exact=Pending'), few[0])
+
+    def test_product_search_uses_sku_and_full_text_index(self):
+        rebuild_index()
+        Product.objects.create(sku='LIN-1', name='Plain dress', price=Decimal('5.00'), description='Linen weave')
+        url = '/admin/checkapp/product/'
+        for term in ('LIN-1', 'linen', 'plain dre'):
+            self.assertEqual([p.sku for p in self.client.get(url, {'q': term}).context['cl'].result_list], ['LIN-1'])
+        self.assertFalse(self.client.get(url, {'q': 'velvet'}).context['cl'].result_list)
+
+    def test_order_stats_search_is_exact(self):
+        self.place_orders(1)
+        url = '/admin/checkapp/userorderstats/'
+        self.assertEqual(list(self.client.get(url, {'q': 'buyer@example.com'}).context['cl'].result_list), [
+            UserOrderStats.objects.get(pk=self.customer.pk),
+        ])
+        self.assertFalse(self.client.get(url, {'q': 'buyer'}).context['cl'].result_list)
+
+    def test_change_view_lists_items(self):
+        order = self.place_orders(1)[0]
+        self.assertContains(self.client.get(f'/admin/checkapp/order/{order.pk}/change/'), 'Dress 0')
+
+    def test_status_action_is_one_update(self):
+        orders = self.place_orders(3)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/admin/checkapp/order/', {
+                'action': 'mark_paid',
+                '_selected_action': [order.pk for order in orders],
+            })
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "checkapp_order"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Order.objects.filter(status='Paid').count(), 3)
+        self.assertEqual(UserOrderStats.objects.get(pk=self.customer.pk).paid_count, 3)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class OrderConfirmationTests(TestCase):
+    def setUp(self):
+        self.products = make_products(3)
+        self.buyer = User.objects.create_user('buyer@example.com', password='pw')
+        fill_cart(self.buyer, self.products)
+        self.order = place_order(self.buyer, billing())
+
+    def test_shows_the_buyers_own_order_in_constant_queries(self):
+        other = User.objects.create_user('other@example.com', password='pw')
+        fill_cart(other, self.products)
+        place_order(other, billing())  # newer order by someone else
+        self.client.force_login(self.buyer)
+        url = confirmation_url(self.order)
+        self.client.get(url)  # first render creates the gateway order
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.context['order'].pk, self.order.pk)
+        self.assertEqual(len(response.context['order_items']), 3)
+        order_queries = [q for q in ctx.captured_queries if 'checkapp_order' in q['sql']]
+        self.assertEqual(len(order_queries), 1)  # the order joined to its receipt
+
+    def test_other_users_and_forged_refs_are_refused(self):
+        intruder = User.objects.create_user('intruder@example.com', password='pw')
+        self.client.force_login(intruder)
+        self.assertEqual(self.client.get(confirmation_url(self.order)).status_code, 404)
+        forged = f'/order_confirmation/?ref={self.order.pk}'
+        self.assertRedirects(self.client.get(forged), '/cart/', fetch_redirect_response=False)
+
+
+COMPRESSED_STATIC = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'checkapp.storage.CompressedManifestStaticFilesStorage'},
+}
+
+
+class StaticAssetTests(TestCase):
+    def setUp(self):
+        self.static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.static_root.cleanup)
+        settings_override = override_settings(STATIC_ROOT=self.static_root.name, STORAGES=COMPRESSED_STATIC)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.static_root.name, 'staticfiles.json')) as handle:
+            self.hashed = json.load(handle)['paths']['checkapp/css/order_history.css']
+
+    def fetch(self, path, **headers):
+        response = self.client.get(f'/static/{path}', headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else b''
+
+    def test_pages_link_fingerprinted_styles_instead_of_inlining_them(self):
+        user = User.objects.create_user('styles@example.com', password='pw')
+        self.client.force_login(user)
+        response = self.client.get('/order_history/')
+        self.assertNotContains(response, '<style')
+        self.assertContains(response, f'/static/{self.hashed}')
+
+    def test_checkout_renders_products_without_an_image(self):
+        user = User.objects.create_user('noimage@example.com', password='pw')
+        product = Product.objects.create(sku='N1', name='Plain dress', price=Decimal('5.00'), image='')
+        self.client.force_login(user)
+        self.client.get(f'/add_to_cart/{product.id}/')
+        response = self.client.get('/checkout/')
+        self.assertContains(response, 'fa-box-open')
+
+    def test_precompressed_variant_with_immutable_caching(self):
+        response, body = self.fetch(self.hashed, accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        _, plain = self.fetch(self.hashed)
+        self.assertEqual(gzip.decompress(body), plain)
+        self.assertIn(b'.history-card', plain)
+
+    def test_unhashed_names_are_not_cached_for_long(self):
+        response, _ = self.fetch('checkapp/css/order_history.css')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.fetch('../db.sqlite3')[0].status_code, 404)
 
-# Create your tests here.
@@ -1,26 +1,128 @@
+import hashlib
+import hmac
+import json
+import logging
+import mimetypes
+import os
+from functools import lru_cache
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.urls import reverse   # ✅ NEW
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.contrib.auth.models import User
-
-import razorpay
-
-from .models import Product, CartItem, BillingDetails, Order, OrderItem
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.functions import Substr
+
+from .models import Product, CartItem, BillingDetails, Order, PaymentEvent, UserOrderStats
+from .cache import CATALOGUE_CACHE_TIMEOUT, acatalogue_key, catalogue_key
+from .cart import flush_cart, get_cart
+from . import feeds
 from .forms import BillingDetailsForm
+from .gateway import PaymentGatewayError, get_gateway
+from . import metrics
+from .pagination import akeyset_page, decode_cursor, encode_cursor
+from .receipts import Receipt
+from .search import search_products
+from .services import aensure_gateway_order, arecord_payment_event, place_order
+from .stock import OutOfStock
+
+logger = logging.getLogger(__name__)
 
 
 # --- Product listing / detail ---
 
-def product_list(request):
-    All_data = Product.objects.all()
-    return render(request, 'productpage.html', {'All_data': All_data})
+CATALOGUE_PAGE_SIZE = 24
+
+
+# The listing, product page and order history are async, like order_confirmation:
+# mostly cache hits and one indexed query each, none of which needs a worker thread
+# under ASGI. Their templates read only what the view loaded.
+
+async def product_list(request):
+    cursor = request.GET.get('cursor', '')
+    # Keyed on the id the cursor points after, never on the raw query string: junk
+    # cursors (which show the first page anyway) all share the first page's entry
+    values = decode_cursor(cursor)
+    if values and len(values) == 1 and type(values[0]) is int:
+        cursor = encode_cursor(values)
+        key = await acatalogue_key('list', values[0])
+    else:
+        cursor = ''
+        key = await acatalogue_key('list', 'first')
+    page = await cache.aget(key)
+    if page is None:
+        # Listing columns only, plus a short DB-side excerpt instead of the full description
+        products = Product.objects.only('id', 'name', 'price', 'image').annotate(
+            summary=Substr('description', 1, 80)
+        )
+        page = await akeyset_page(products, ('id',), cursor=cursor, page_size=CATALOGUE_PAGE_SIZE)
+        await cache.aset(key, page, CATALOGUE_CACHE_TIMEOUT)
+
+    return render(request, 'productpage.html', {
+        'All_data': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not cursor,
+    })
+
+
+def product_search(request):
+    query = request.GET.get('q', '').strip()[:100]
+    cursor = request.GET.get('cursor', '')
+    # Hashed: cache keys must stay short and free of spaces whatever the user typed
+    key = catalogue_key('search', hashlib.sha256(f'{query}\0{cursor}'.encode()).hexdigest())
+    page = cache.get(key)
+    if page is None:
+        products = Product.objects.only('id', 'name', 'price', 'image').annotate(
+            summary=Substr('description', 1, 80)
+        )
+        page = search_products(query, products, cursor=cursor, page_size=CATALOGUE_PAGE_SIZE)
+        cache.set(key, page, CATALOGUE_CACHE_TIMEOUT)
+
+    return render(request, 'productpage.html', {
+        'All_data': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not cursor,
+        'query': query,
+    })
 
 
-def single_product(request, product_id):
-    single_data = get_object_or_404(Product, id=product_id)
-    return render(request, 'singleproduct.html', {'single_data': single_data})
+async def single_product(request, product_id):
+    # Rendered page is cached per product and catalogue version (bumped on any Product change)
+    key = await acatalogue_key('product', product_id)
+    entry = await cache.aget(key)
+    if entry is None:
+        try:
+            single_data = await Product.objects.aget(id=product_id)
+        except Product.DoesNotExist:
+            raise Http404("No Product matches the given query.")
+        content = render_to_string('singleproduct.html', {'single_data': single_data}, request)
+        entry = {
+            'content': content,
+            'etag': f'"{single_data.id}-{single_data.updated_at.timestamp():.6f}"',
+            'last_modified': single_data.updated_at.timestamp(),
+        }
+        await cache.aset(key, entry, CATALOGUE_CACHE_TIMEOUT)
+
+    # Answers If-None-Match / If-Modified-Since with a 304 and no body
+    not_modified = get_conditional_response(
+        request, etag=entry['etag'], last_modified=int(entry['last_modified'])
+    )
+    response = not_modified or HttpResponse(entry['content'])
+    response.headers['ETag'] = entry['etag']
+    response.headers['Last-Modified'] = http_date(entry['last_modified'])
+    patch_cache_control(response, public=True, max_age=60)
+    return response
 
 
 # --- Cart operations ---
@@ -29,53 +131,35 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
 from .models import Product, CartItem
 
-@login_required
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    if not Product.objects.filter(id=product_id).exists():
+        raise Http404("No such product")
 
-    cart_item, created = CartItem.objects.get_or_create(
-        user=request.user,
-        cartproduct=product
-    )
-
-    if created:
-        cart_item.quantity = 1
-    else:
-        cart_item.quantity += 1
-
-    cart_item.save()
+    # Session cart by default: no CartItem write per click (see checkapp/cart.py)
+    get_cart(request).add(product_id)
     return redirect('cart_view')
 
 
-@login_required
 def cart_view(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    total_amount = sum(item.cartproduct.price * item.quantity for item in cart_items)
+    cart = get_cart(request)
+    totals = cart.totals()
     return render(request, 'cart.html', {
-        'cart_items': cart_items,
-        'total_amount': total_amount
+        'cart_items': cart.lines(),
+        'total_amount': totals['total_amount'],
+        'item_count': totals['item_count'],
     })
 
 
-@login_required
-def cart_update(request, cart_id):
-    cart_item = get_object_or_404(CartItem, id=cart_id, user=request.user)
-
+def cart_update(request, product_id):
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-        else:
-            cart_item.delete()
+        get_cart(request).set(product_id, quantity)  # 0 or less removes the line
 
     return redirect('cart_view')
 
 
-@login_required
-def remove_cart(request, cart_id):
-    cart_item = get_object_or_404(CartItem, id=cart_id, user=request.user)
-    cart_item.delete()
+def remove_cart(request, product_id):
+    get_cart(request).remove(product_id)
     return redirect('cart_view')
 
 
@@ -85,54 +169,35 @@ from django.contrib.auth.decorators import login_required
 
 @login_required
 def checkout(request):
-    # ✅ Always filter cart by logged-in user
-    cart_items = CartItem.objects.filter(user=request.user)
-    total_price = sum(item.cartproduct.price * item.quantity for item in cart_items)
+    cart = get_cart(request)
+    cart_items = cart.lines()
+    totals = cart.totals()
 
     if request.method == 'POST':
         form = BillingDetailsForm(request.POST)
         if form.is_valid():
-            # 1) Save billing details & attach user
-            billing_details = form.save(commit=False)
-            billing_details.user = request.user
-            billing_details.save()
-
-            # 2) Recalculate totals from THIS user's cart
-            cart_items = CartItem.objects.filter(user=request.user)
-            if not cart_items.exists():
-                return redirect('cart_view')
-
-            total_quantity = sum(item.quantity for item in cart_items)
-            total_price = sum(item.cartproduct.price * item.quantity for item in cart_items)
-
-            # 3) Create Order (linked to billing + user)
-            order = Order.objects.create(
-                user=request.user,                # ✅ IMPORTANT
-                billing_details=billing_details,
-                total_price=total_price,
-                total_quantity=total_quantity,
-                status="Pending"
-            )
-
-            # 4) Create OrderItem(s) from CartItem(s)
-            for item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.cartproduct,
-                    quantity=item.quantity,
-                    price=item.cartproduct.price,
-                )
-
-            # (optional) clear cart after order
-            # cart_items.delete()
-
-            return redirect('order_confirmation')
+            # Session cart is bulk-flushed to CartItem, then billing details, Order,
+            # OrderItems, stock reservations and cart clearing happen in the same transaction
+            try:
+                with transaction.atomic():
+                    flush_cart(request)
+                    order = place_order(request.user, form.save(commit=False))
+            except OutOfStock as exc:
+                name = next((line.cartproduct.name for line in cart_items if line.cartproduct.id == exc.product_id), 'An item')
+                form.add_error(None, f"{name} is sold out (only {exc.available} left). Please update your cart.")
+            else:
+                if order is None:
+                    return redirect('cart_view')
+
+                cart.clear()
+                return redirect(confirmation_url(order))
     else:
         form = BillingDetailsForm()
 
     context = {
         'cart_items': cart_items,
-        'total_price': total_price,
+        'total_price': totals['total_amount'],
+        'item_count': totals['item_count'],
         'form': form,
     }
     return render(request, 'checkout.html', context)
@@ -140,27 +205,37 @@ def checkout(request):
 
 # --- Order confirmation (Razorpay order creation) ---
 
-def order_confirmation(request):
-    # Last created order
-    order = Order.objects.last()
+CONFIRMATION_SALT = 'checkapp.order_confirmation'
 
-    if not order:
-        return redirect('cart_view')
 
-    order_items = order.items.all()  # from related_name='items' in OrderItem
+def confirmation_url(order):
+    """Where checkout sends the buyer: the order id travels signed, so it can't be swapped."""
+    return reverse('order_confirmation') + '?ref=' + signing.dumps(order.pk, salt=CONFIRMATION_SALT)
 
-    # Razorpay client
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 
-    # Razorpay works in paise
-    amount_paise = int(order.total_price * 100)
+@login_required
+async def order_confirmation(request):
+    # Async so that waiting on Razorpay does not hold a worker thread (serve via ASGI).
+    # Everything the template reads is loaded here; no lazy queries during render.
+    try:
+        order_id = signing.loads(request.GET.get('ref', ''), salt=CONFIRMATION_SALT)
+    except signing.BadSignature:
+        return redirect('cart_view')
 
-    # Create Razorpay order
-    razorpay_order = client.order.create({
-        "amount": amount_paise,
-        "currency": "INR",
-        "payment_capture": 1,  # Auto capture
-    })
+    # Primary-key lookup scoped to the buyer: constant cost however many orders exist.
+    # Lines, address and totals come from the receipt snapshot joined into the same row.
+    user = await request.auser()
+    try:
+        order = await Order.objects.select_related('receipt').aget(pk=order_id, user=user)
+    except Order.DoesNotExist:
+        raise Http404("No such order")
+    receipt = Receipt(order.receipt.data)
+
+    # Razorpay order is created once per Order and reused on every later render
+    try:
+        await aensure_gateway_order(order)
+    except PaymentGatewayError:
+        logger.exception("Could not create gateway order for order %s", order.id)
 
     # ✅ Build FULL absolute callback URL for Razorpay
     callback_url = request.build_absolute_uri(
@@ -169,14 +244,14 @@ def order_confirmation(request):
 
     context = {
         'order': order,
-        'order_items': order_items,
-        'delivery': order.billing_details,
-        'total_price': order.total_price,
+        'order_items': receipt.lines,
+        'delivery': receipt.delivery,
+        'total_price': receipt.total_price,
 
         # Razorpay related
         'razorpay_key_id': settings.RAZORPAY_KEY_ID,
-        'razorpay_order_id': razorpay_order['id'],
-        'razorpay_amount': amount_paise,
+        'razorpay_order_id': order.razorpay_order_id,
+        'razorpay_amount': order.razorpay_amount,
         'callback_url': callback_url,  # ✅ send to template
     }
     return render(request, 'order_confirmation.html', context)
@@ -185,13 +260,14 @@ def order_confirmation(request):
 # --- Payment success callback (Razorpay -> this URL) ---
 
 @csrf_exempt
-def payment_success(request):
+async def payment_success(request):
     """
     Razorpay will POST to this URL after payment with:
     - razorpay_payment_id
     - razorpay_order_id
     - razorpay_signature
-    We verify signature and then mark order as Paid.
+    We verify the signature and queue the "Paid" status change; the
+    process_payment_events command applies it, so this view never writes Order.
     """
     if request.method != "POST":
         return HttpResponseBadRequest("Invalid request method")
@@ -204,31 +280,61 @@ def payment_success(request):
     if not (razorpay_payment_id and razorpay_order_id and razorpay_signature and order_id):
         return HttpResponseBadRequest("Missing parameters")
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
-    params_dict = {
-        'razorpay_order_id': razorpay_order_id,
-        'razorpay_payment_id': razorpay_payment_id,
-        'razorpay_signature': razorpay_signature
-    }
+    # Verify the signature from Razorpay (local HMAC, no network call)
+    payment_ok = get_gateway().verify_payment_signature(
+        razorpay_order_id, razorpay_payment_id, razorpay_signature
+    )
 
     try:
-        # Verify the signature from Razorpay
-        client.utility.verify_payment_signature(params_dict)
-        payment_ok = True
-    except razorpay.errors.SignatureVerificationError:
-        payment_ok = False
-
-    order = get_object_or_404(Order, id=order_id)
+        order = await Order.objects.only('id', 'status', 'total_price').aget(id=order_id)
+    except (Order.DoesNotExist, ValueError):
+        raise Http404("No Order matches the given query.")
 
     if payment_ok:
-        order.status = "Paid"
-        order.save()
-        return render(request, 'payment_success.html', {"order": order})
+        await arecord_payment_event(
+            razorpay_payment_id, razorpay_order_id, "Paid", PaymentEvent.SOURCE_CALLBACK,
+            {'razorpay_order_id': razorpay_order_id, 'razorpay_payment_id': razorpay_payment_id},
+        )
+        return render(request, 'payment_success.html', {"order": order, "status": "Paid"})
     else:
-        order.status = "Payment Failed"
-        order.save()
-        return render(request, 'payment_failed.html', {"order": order})
+        # Unverified callbacks are not trusted to change the order at all
+        return render(request, 'payment_failed.html', {
+            "order": order, "status": "Payment Failed", "retry_url": confirmation_url(order),
+        })
+
+
+# Razorpay webhook events we act on, and the Order status each one leads to
+WEBHOOK_STATUSES = {
+    'payment.captured': "Paid",
+    'order.paid': "Paid",
+    'payment.failed': "Payment Failed",
+}
+
+
+@csrf_exempt
+async def razorpay_webhook(request):
+    """
+    Server-to-server webhook. Checks the X-Razorpay-Signature HMAC over the raw
+    body, queues the event and answers 200 straight away; unknown events are
+    acknowledged and dropped so Razorpay does not keep retrying them.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest("Invalid request method")
+
+    signature = request.headers.get('X-Razorpay-Signature', '')
+    if not get_gateway().verify_webhook_signature(request.body, signature):
+        return HttpResponseBadRequest("Invalid signature")
+
+    try:
+        event = json.loads(request.body)
+        status = WEBHOOK_STATUSES.get(event.get('event'))
+        payment = event['payload']['payment']['entity'] if status else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return HttpResponseBadRequest("Malformed payload")
+
+    if status and payment.get('id') and payment.get('order_id'):
+        await arecord_payment_event(payment['id'], payment['order_id'], status, PaymentEvent.SOURCE_WEBHOOK, event)
+    return HttpResponse(status=200)
     
 
 
@@ -289,7 +395,7 @@ def login_view(request):
 
         user = authenticate(request, username=username, password=password)
         if user is not None:
-            login(request, user)
+            login(request, user)  # signals.py merges the session cart into the user's
             return redirect('product_list')
         else:
             messages.error(request, 'Invalid username or password')
@@ -298,6 +404,7 @@ def login_view(request):
 
 from django.contrib.auth import logout
 def log_out_view(request):
+    flush_cart(request)  # logout() wipes the session, so keep the cart in CartItem
     logout(request)
     return redirect('login_view')
 
@@ -306,7 +413,113 @@ def log_out_view(request):
 
 from django.contrib.auth.decorators import login_required
 
+ORDER_HISTORY_PAGE_SIZE = 20
+
+
 @login_required
-def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-order_date')
-    return render(request, 'order_history.html', {'orders': orders})
+async def order_history(request):
+    # One query for the page of orders, each joined to its receipt snapshot (item names,
+    # images and counts); keyset pagination keeps deep pages as cheap as the first one
+    user = await request.auser()
+    page = await akeyset_page(
+        Order.objects.filter(user=user).select_related('receipt'),
+        ('-order_date', '-id'),
+        cursor=request.GET.get('cursor'),
+        page_size=ORDER_HISTORY_PAGE_SIZE,
+    )
+    for order in page.items:
+        order.summary = Receipt(order.receipt.data)
+    return render(request, 'order_history.html', {
+        'user': user,  # loaded; the lazy request.user would query synchronously
+        # Lifetime totals are kept up to date in UserOrderStats: one primary-key lookup
+        'stats': await UserOrderStats.objects.filter(pk=user.pk).afirst(),
+        'orders': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+    })
+
+
+def metrics_view(request):
+    """
+    Per-URL-name latency percentiles and per-request SQL/template/gateway costs
+    as JSON. Readable by staff users or with `Authorization: Bearer <TOKEN>`.
+    """
+    token = metrics.get_options()['TOKEN']
+    bearer = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not (request.user.is_staff or (token and hmac.compare_digest(bearer, token))):
+        return HttpResponse(status=403)
+    return JsonResponse(metrics.summarize(metrics.metrics_snapshot()))
+
+
+@staff_member_required
+def export_products(request):
+    """The product feed as a download, streamed from a server-side cursor chunk by chunk."""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in feeds.FORMATS:
+        return HttpResponseBadRequest("Unknown format")
+    response = StreamingHttpResponse(feeds.export_rows(fmt), content_type=feeds.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
+
+
+# --- Static assets (collected by CompressedManifestStaticFilesStorage) ---
+
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_MUTABLE_MAX_AGE = 60
+
+# Precompressed copies written at collectstatic time, best first
+STATIC_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+@lru_cache(maxsize=1)
+def _fingerprinted_names(storage):
+    # Hashed (keyed) by the configured storage instance, so a new one re-reads its manifest
+    return frozenset(getattr(storage, 'hashed_files', {}).values())
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def static_asset(request, path):
+    """
+    A file from STATIC_ROOT. Fingerprinted names never change content, so they
+    are cached for a year as immutable; the .br / .gz copy is sent instead of
+    the original when the client accepts it.
+    """
+    if not settings.STATIC_ROOT:
+        raise Http404("Static files are not collected")
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:  # the path escapes STATIC_ROOT
+        raise Http404("No such file")
+    if not os.path.isfile(full_path):
+        raise Http404("No such file")
+
+    mtime = os.stat(full_path).st_mtime
+    response = get_conditional_response(request, last_modified=int(mtime))
+    if response is None:
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        served_path, encoding = full_path, None
+        for coding, suffix in STATIC_ENCODINGS:
+            if coding in accepted and os.path.isfile(full_path + suffix):
+                served_path, encoding = full_path + suffix, coding
+                break
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        response = FileResponse(open(served_path, 'rb'), content_type=content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Last-Modified'] = http_date(mtime)
+
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if path in _fingerprinted_names(staticfiles_storage):
+        patch_cache_control(response, public=True, max_age=STATIC_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=STATIC_MUTABLE_MAX_AGE)
+    return response
+
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'checkout.settings')
 
 application = get_asgi_application()
+
+# All requests share the server's event loop, so checkapp can pool per-loop state
+from checkapp.gateway import use_long_lived_loop  # noqa: E402  (needs settings loaded)
+
+use_long_lived_loop()
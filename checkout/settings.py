@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole stack (see checkapp/metrics.py)
+    'checkapp.metrics.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +57,8 @@ ROOT_URLCONF = 'checkout.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates plus per-request render timing
+        'BACKEND': 'checkapp.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -72,15 +76,110 @@ WSGI_APPLICATION = 'checkout.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
+#
+# Chosen with DB_ENGINE:
+#   sqlite   (default) db.sqlite3 in WAL mode, tuned for concurrent checkouts
+#            (set SQLITE_TUNING=0 for SQLite's stock rollback-journal settings)
+#   postgres PostgreSQL via psycopg 3; persistent connections with health checks,
+#            or a psycopg_pool pool when DB_POOL_MAX_SIZE is set (needs psycopg[pool])
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'checkout'),
+            'USER': os.environ.get('POSTGRES_USER', 'checkout'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # Django's pool hands connections back after each request, so it replaces CONN_MAX_AGE
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # File-backed test database: the in-memory default can't make concurrent
+            # writers wait for each other, which the cart/payment race tests rely on
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+            'OPTIONS': {
+                'timeout': 20,  # seconds a writer waits for the lock before "database is locked"
+            },
+        }
+    }
+    if os.environ.get('SQLITE_TUNING', '1') == '1':
+        DATABASES['default']['OPTIONS'].update({
+            # Run on every new connection: readers no longer block the writer (WAL),
+            # commits skip the per-transaction fsync, reads are served from mmap
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=20000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            # Take the write lock at BEGIN so two checkouts can't deadlock upgrading read locks
+            'transaction_mode': 'IMMEDIATE',
+        })
+
+
+# Cache
+# Product pages are cached with versioned keys (checkapp/cache.py). Use a shared
+# backend (e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://127.0.0.1:6379) when running more than one process.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
 
+# Sessions and request.user without a database round trip on most requests:
+# cached_db reads sessions from CACHES and falls back to (and writes through to) the
+# database; 'django.contrib.sessions.backends.cache' skips the database entirely but
+# needs a shared, persistent cache. CachedModelBackend (checkapp/auth.py) keeps the
+# logged-in user in CACHES for AUTH_USER_CACHE_TIMEOUT seconds, dropped on every save.
+# Both are only on by default with a shared cache: with the per-process LocMemCache a
+# logout or password change would only reach the worker that handled it (checkapp.E001).
+SHARED_CACHE = CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+SESSION_ENGINE = os.environ.get(
+    'SESSION_ENGINE',
+    'django.contrib.sessions.backends.cached_db' if SHARED_CACHE else 'django.contrib.sessions.backends.db',
+)
+AUTHENTICATION_BACKENDS = ['checkapp.auth.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 300 if SHARED_CACHE else 0))  # seconds; 0 disables
+
+# Where @login_required sends anonymous users (e.g. from checkout)
+LOGIN_URL = 'login_view'
+
+# Cart storage (checkapp/cart.py): 'session' keeps active carts in the session and
+# only writes CartItem at login/checkout/logout; 'database' writes CartItem on every change.
+CART_BACKEND = os.environ.get('CART_BACKEND', 'session')
+
+# Per-request Server-Timing header and per-URL latency histograms (checkapp/metrics.py).
+# Workers share their histograms through CACHES, so use a shared cache backend in production.
+PERF_METRICS = {
+    'ENABLED': os.environ.get('PERF_METRICS', '1') == '1',
+    'FLUSH_INTERVAL': 10,   # seconds
+    'TOKEN': os.environ.get('PERF_METRICS_TOKEN', ''),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -114,12 +213,46 @@ USE_TZ = True
 RAZORPAY_KEY_ID ='rzp_test_RjbHh9BhN91Vdc'
 RAZORPAY_KEY_SECRET= '04dZ8IcJ7NaBRLcHxcTpyvKb'
 
+# Shared gateway client (see checkapp/gateway.py). Set PAYMENT_GATEWAY_BACKEND to
+# 'checkapp.gateway.FakeGateway' to run load tests offline without reaching Razorpay.
+PAYMENT_GATEWAY = {
+    'BACKEND': os.environ.get('PAYMENT_GATEWAY_BACKEND', 'checkapp.gateway.RazorpayGateway'),
+    'CONNECT_TIMEOUT': 3.05,   # seconds
+    'READ_TIMEOUT': 10,        # seconds
+    'MAX_RETRIES': 2,          # idempotent calls only
+    'POOL_MAXSIZE': 20,        # keep-alive connections kept per process
+    'WEBHOOK_SECRET': os.environ.get('RAZORPAY_WEBHOOK_SECRET', ''),
+}
+
+
+# Inventory (see checkapp/stock.py). Products only become stock-tracked once their
+# units are set (set_stock command or the Product admin); run
+# release_expired_reservations periodically to put unpaid orders' units back on sale.
+STOCK = {
+    'SHARDS': 8,                 # counter rows per product; more rows, less contention
+    'RESERVATION_TTL': 15 * 60,  # seconds
+}
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
-STATICFILES_DIRS = [BASE_DIR / 'D:\checkoutdirectory\checkout\checkout\static']
+# App styles live in checkapp/static/checkapp/ and are found by the app directories finder
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic fingerprints every file (checkapp/css/cart.css -> cart.<hash>.css) and writes
+# .gz / .br copies; checkapp.views.static_asset serves them with one-year immutable caching.
+# While DEBUG is on, files are served unhashed straight from the apps instead.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'checkapp.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
 
 
 # Default primary key field type
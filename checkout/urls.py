@@ -19,7 +19,12 @@ from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from checkapp.views import static_asset
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('',include('checkapp.urls')),
+    # Collected, fingerprinted assets with precompressed variants and far-future caching.
+    # (runserver with DEBUG on serves static files itself, straight from the apps.)
+    path(f"{settings.STATIC_URL.lstrip('/')}<path:path>", static_asset, name='static_asset'),
 ]+ static (settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)